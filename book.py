@@ -0,0 +1,146 @@
+import os
+import random
+from typing import Dict, List, Optional, Tuple
+
+import chess
+import numpy as np
+from chess import polyglot
+from chess.polyglot import zobrist_hash
+
+from config import Config
+
+# Polyglot book entries: key, move, weight and learn, big endian.
+POLYGLOT_ENTRY = np.dtype([("key", ">u8"), ("move", ">u2"), ("weight", ">u2"), ("learn", ">u4")])
+
+# Books opened by this process, indexed by (process id, path, in memory).
+# The book file is opened (or loaded) only once, the first time it's used.
+_BOOKS: Dict[Tuple[int, str, bool], "OpeningBook"] = {}
+
+
+def decode_move(board: chess.Board, raw_move: int) -> chess.Move:
+    """
+    Decodes a polyglot move for the board. Polyglot books store
+    castling as the king capturing its own rook (e.g. e1h1).
+    """
+    from_square = (raw_move >> 6) & 63
+    to_square = raw_move & 63
+    promotion = (raw_move >> 12) & 7
+    own_rooks = board.rooks & board.occupied_co[board.turn]
+    if board.kings & chess.BB_SQUARES[from_square] and own_rooks & chess.BB_SQUARES[to_square]:
+        file = 6 if to_square > from_square else 2
+        to_square = chess.square(file, chess.square_rank(from_square))
+    return chess.Move(from_square, to_square, promotion + 1 if promotion else None)
+
+
+class OpeningBook:
+    """
+    Polyglot opening book, opened once and reused for every lookup.
+
+    By default the book file is memory mapped and searched in place. It can
+    also be loaded in memory, compiled to sorted arrays of Zobrist keys, moves
+    and weights that are binary searched, which avoids reading the file on
+    lookups at the cost of loading it upfront.
+
+    A missing or invalid book file is an empty book: lookups find no moves.
+    """
+
+    def __init__(self, path: Optional[str], in_memory: bool = False):
+        """
+        Arguments:
+            - path: polyglot book file, if None the book is empty.
+            - in_memory: if True the book is loaded in memory instead of memory mapped.
+        """
+        self.reader: Optional[polyglot.MemoryMappedReader] = None
+        self.keys = np.zeros(0, dtype=np.uint64)
+        self.moves = np.zeros(0, dtype=np.uint16)
+        self.weights = np.zeros(0, dtype=np.uint16)
+
+        # books are a sequence of 16 bytes entries, anything else isn't a book
+        # (e.g. a git lfs pointer that was never downloaded)
+        if not path or not os.path.isfile(path) or os.path.getsize(path) % POLYGLOT_ENTRY.itemsize:
+            return
+
+        if in_memory:
+            entries = np.fromfile(path, dtype=POLYGLOT_ENTRY)
+            self.keys = entries["key"].astype(np.uint64)
+            self.moves = entries["move"].astype(np.uint16)
+            self.weights = entries["weight"].astype(np.uint16)
+        else:
+            self.reader = polyglot.MemoryMappedReader(path)
+
+    def __len__(self) -> int:
+        if self.reader is not None:
+            return len(self.reader)
+        return len(self.keys)
+
+    def entries(self, board: chess.Board) -> List[Tuple[chess.Move, int]]:
+        """
+        Returns the legal moves of the board found in the book.
+
+        Arguments:
+            - board: chess board state.
+
+        Returns:
+            - entries: list of (move, weight), empty if the board isn't in the book.
+        """
+        if self.reader is not None:
+            return [(entry.move, entry.weight) for entry in self.reader.find_all(board)]
+        if not len(self.keys):
+            return []
+
+        key = np.uint64(zobrist_hash(board))
+        first = int(np.searchsorted(self.keys, key, side="left"))
+        last = int(np.searchsorted(self.keys, key, side="right"))
+        entries = []
+        for raw_move, weight in zip(self.moves[first:last], self.weights[first:last]):
+            move = decode_move(board, int(raw_move))
+            # keys may collide, so moves are checked
+            if weight > 0 and board.is_legal(move):
+                entries.append((move, int(weight)))
+        return entries
+
+    def choose(
+        self, board: chess.Board, selection: str = "best", max_ply: Optional[int] = None,
+    ) -> Optional[chess.Move]:
+        """
+        Chooses a book move for the board.
+
+        Arguments:
+            - board: chess board state.
+            - selection: "best" to play the move with the highest weight,
+                "weighted" to pick a move at random, proportionally to its weight.
+            - max_ply: the book is only used for the first max_ply plies of the game.
+
+        Returns:
+            - move: book move, or None if the board isn't in the book.
+        """
+        if max_ply is not None and board.ply() >= max_ply:
+            return None
+
+        entries = self.entries(board)
+        if not entries:
+            return None
+        if selection == "weighted":
+            moves, weights = zip(*entries)
+            return random.choices(moves, weights=weights)[0]
+        return max(entries, key=lambda entry: entry[1])[0]
+
+
+def open_book(path: Optional[str], in_memory: bool = False) -> OpeningBook:
+    """
+    Returns the opening book for the given path, opening
+    it only the first time it's requested by this process.
+    """
+    key = (os.getpid(), path or "", in_memory)
+    if key not in _BOOKS:
+        _BOOKS[key] = OpeningBook(path, in_memory)
+    return _BOOKS[key]
+
+
+def book_move(board: chess.Board, config: Config) -> Optional[chess.Move]:
+    """
+    Returns the book move for the board, following
+    the book options of the configuration.
+    """
+    book = open_book(config.book_path, config.book_in_memory)
+    return book.choose(board, config.book_selection, config.book_depth)
@@ -0,0 +1,92 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Generic, Hashable, Optional, TypeVar, Union
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """
+    Fixed-capacity mapping that evicts the least recently used entry
+    when it's full. It counts hits, misses and evictions, so we can
+    check if the cache is paying for itself.
+
+    Entries can also expire after a time to live, e.g. for results
+    that become stale.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        """
+        Arguments:
+            - maxsize: maximum number of entries kept in the cache.
+            - ttl: seconds an entry is kept, None to keep it until it's evicted.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, V]" = OrderedDict()
+        # time (time.monotonic) at which each entry expires, when there's a ttl
+        self.expires: Dict[Hashable, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[V]:
+        """
+        Returns the value stored for the key, or None if it's not cached.
+        """
+        value = self.entries.get(key)
+        if value is not None and self.ttl is not None and self.expires[key] <= time.monotonic():
+            del self.entries[key]
+            del self.expires[key]
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: V):
+        """
+        Stores a value, evicting the least recently used entry if needed.
+        """
+        if self.maxsize <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if self.ttl is not None:
+            self.expires[key] = time.monotonic() + self.ttl
+        self._evict()
+
+    def _evict(self):
+        while len(self.entries) > max(self.maxsize, 0):
+            key, _ = self.entries.popitem(last=False)
+            self.expires.pop(key, None)
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Removes all entries and resets the statistics.
+        """
+        self.entries.clear()
+        self.expires.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        Returns the cache size and its hit/miss/eviction counters.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self) -> int:
+        return len(self.entries)
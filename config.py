@@ -1,10 +1,41 @@
 from dataclasses import dataclass
-from typing import Optional
+from typing import List, Optional
 
 # Score for checkmate.
 CHECKMATE_SCORE = 10**8
 # Threshold to differentiate checkmates from other moves.
 CHECKMATE_THRESHOLD = 999 * (10**4)
+# Default size of the transposition table in MB.
+HASH_SIZE = 64
+# Number of syzygy probe results kept in memory.
+SYZYGY_CACHE_SIZE = 2**16
+# Initial half-width of the aspiration window around the previous score.
+ASPIRATION_WINDOW = 50
+# Safety margin added to the captured piece value for delta pruning.
+DELTA_MARGIN = 200
+# Late move reductions: minimum remaining depth, number of moves
+# searched before we start reducing, and depth reduction.
+LMR_MIN_DEPTH = 3
+LMR_MIN_MOVES = 3
+LMR_REDUCTION = 1
+# Futility pruning margins, per ply of remaining depth.
+FUTILITY_MARGIN = 200
+REVERSE_FUTILITY_MARGIN = 150
+# Start methods supported for the worker processes of parallel engines.
+START_METHODS = ("fork", "forkserver", "spawn")
+# Polyglot opening book, and how moves are chosen from it.
+BOOK_PATH = "opening_book/cerebellum.bin"
+BOOK_SELECTIONS = ("best", "weighted")
+# Searches waiting for a worker in API mode, and the longest
+# search (in milliseconds) a request can ask for.
+API_QUEUE_SIZE = 64
+API_MOVETIME = 10000
+# Search results kept by the API, and for how many seconds.
+API_CACHE_SIZE = 4096
+API_CACHE_TTL = 300
+# Options that only change how positions are searched, engines
+# apply them between searches without being created again.
+SEARCH_OPTIONS = ("null_move", "null_move_r", "quiescence_search_depth")
 
 
 @dataclass
@@ -22,3 +53,44 @@ class Config:
     syzygy_pieces: int
     checkmate_score: int = CHECKMATE_SCORE
     checkmate_threshold: int = CHECKMATE_THRESHOLD
+    hash_size: int = HASH_SIZE
+    syzygy_cache_size: int = SYZYGY_CACHE_SIZE
+    pvs: bool = False
+    aspiration: bool = False
+    aspiration_window: float = ASPIRATION_WINDOW
+    see_pruning: bool = False
+    delta_pruning: bool = False
+    delta_margin: int = DELTA_MARGIN
+    lmr: bool = False
+    lmr_min_depth: int = LMR_MIN_DEPTH
+    lmr_min_moves: int = LMR_MIN_MOVES
+    lmr_reduction: int = LMR_REDUCTION
+    futility: bool = False
+    futility_margin: int = FUTILITY_MARGIN
+    reverse_futility: bool = False
+    reverse_futility_margin: int = REVERSE_FUTILITY_MARGIN
+    # number of search processes used by parallel engines, defaults to the number of CPUs
+    threads: Optional[int] = None
+    # CPUs the engine is pinned to, each worker runs on one of them
+    # (in API mode they're divided between the search workers)
+    cpu_affinity: Optional[List[int]] = None
+    # start method of the worker processes, defaults to the platform's default
+    start_method: Optional[str] = None
+    # number of best lines searched and reported in UCI analysis
+    multi_pv: int = 1
+    # opening book file (None to play without a book), loaded in memory or memory mapped
+    book_path: Optional[str] = BOOK_PATH
+    book_in_memory: bool = False
+    # book moves are the best ones or picked at random by weight
+    book_selection: str = "best"
+    # the book is only used for this many plies of the game, None for no limit
+    book_depth: Optional[int] = None
+    # search worker processes of the API, defaults to the number of CPUs
+    api_workers: Optional[int] = None
+    # searches waiting for a free worker, requests are rejected when it's full
+    api_queue_size: int = API_QUEUE_SIZE
+    # default and maximum search time of an API request in milliseconds
+    api_movetime: int = API_MOVETIME
+    # fixed depth search results kept by the API, and for how many seconds
+    api_cache_size: int = API_CACHE_SIZE
+    api_cache_ttl: float = API_CACHE_TTL
@@ -0,0 +1,106 @@
+from typing import Iterable, List, Optional, Tuple
+
+from chess import Board, Move
+
+from config import Config
+from engines.lazy_smp import LazySMP
+from engines.parallel_alpha_beta import PackedBoard
+from shared_buffer import SharedBuffer
+from transposition_table import TranspositionTable
+
+# Number of slots of the table of nodes being searched.
+BUSY_SLOTS = 2**16
+
+# Minimum remaining depth of the nodes whose moves can be deferred, the
+# subtrees of shallower nodes are too small to be worth the check.
+MIN_DEFER_DEPTH = 2
+
+
+class ABDADA(LazySMP):
+    """
+    ABDADA (Alpha-Bêta Distribué avec Droit d'Aînesse) parallel search.
+
+    Every process searches the whole tree with iterative deepening, like
+    Lazy SMP, sharing the transposition table and history. Processes mark
+    the nodes they're searching in a table in shared memory, and at each
+    node the eldest brother (the first move) is always searched first.
+    The young brothers being searched by another process are deferred
+    until the others are done, so processes split the siblings of a node
+    between them instead of repeating each other's work, and find the
+    results of the deferred ones in the transposition table.
+    """
+
+    def __init__(self, config: Config, processes: Optional[int] = None):
+        """
+        Arguments:
+            - config: engine configuration.
+            - processes: number of helper processes, defaults
+                to the configured number of threads minus one.
+        """
+        # keys of the nodes being searched, by slot, shared with the workers
+        self.busy_buffer = SharedBuffer(BUSY_SLOTS * 8)
+        self.busy = self.busy_buffer.cast("Q")
+        super().__init__(config, processes)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop("busy", None)
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.busy = self.busy_buffer.cast("Q")
+
+    def helper_arguments(
+        self, position: PackedBoard, depth: int, helper: int,
+    ) -> Tuple[PackedBoard, int, int]:
+        # helpers search like the main search, deferring moves splits the work
+        return position, depth, 0
+
+    def negamax(
+        self,
+        board: Board,
+        depth: int,
+        null_move: bool,
+        cache: TranspositionTable,
+        alpha: float = float("-inf"),
+        beta: float = float("inf"),
+        ply: int = 0,
+    ) -> Tuple[float, Optional[Move]]:
+        if depth < MIN_DEFER_DEPTH:
+            return super().negamax(board, depth, null_move, cache, alpha, beta, ply)
+
+        # the node is marked while we search it, other processes
+        # searching the same one clear it first when they're done
+        key = cache.key(board)
+        slot = key % BUSY_SLOTS
+        self.busy[slot] = key
+        try:
+            return super().negamax(board, depth, null_move, cache, alpha, beta, ply)
+        finally:
+            if self.busy[slot] == key:
+                self.busy[slot] = 0
+
+    def search_order(self, board: Board, moves: List[Move], depth: int) -> Iterable[Move]:
+        # without helpers nobody else searches the nodes
+        if depth < MIN_DEFER_DEPTH or not self.processes:
+            yield from moves
+            return
+
+        deferred = []
+        for index, move in enumerate(moves):
+            # the eldest brother is always searched first
+            if index > 0 and self.searched_elsewhere(board, move):
+                deferred.append(move)
+            else:
+                yield move
+        yield from deferred
+
+    def searched_elsewhere(self, board: Board, move: Move) -> bool:
+        """
+        Returns if another process is searching the node after the move.
+        """
+        board.push(move)
+        key = self.cache.key(board)
+        board.pop()
+        return self.busy[key % BUSY_SLOTS] == key
@@ -1,16 +1,61 @@
-from typing import Optional, Tuple, Dict
-from multiprocessing.managers import DictProxy
+import threading
+import time
+from multiprocessing.synchronize import Event as ProcessEvent
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
 from copy import copy
+from dataclasses import replace
 from chess import Board, Move
 
-from config import Config
-from move_ordering import organize_moves, organize_moves_quiescence
-from psqt import board_evaluation, count_pieces
+from config import SEARCH_OPTIONS, Config
+from move_ordering import MoveOrdering, organize_moves_quiescence, static_exchange_evaluation
+from psqt import MG_PIECE_VALUES, IncrementalEvaluation
 from random import choice
-import chess.syzygy
+from tablebase import TablebaseProber
+from transposition_table import EXACT, LOWER, UPPER, TranspositionTable
+import chess
+
+# Maximum depth for searches limited only by time.
+MAX_DEPTH = 64
+# How many nodes we search between two checks of the clock.
+NODES_BETWEEN_TIME_CHECKS = 128
+# We don't start a new iteration if we already used this
+# fraction of our time, since it would hardly finish.
+ITERATION_TIME_RATIO = 0.5
+# Maximum remaining depth where futility pruning is applied.
+FUTILITY_MAX_DEPTH = 2
+# Maximum remaining depth where reverse futility pruning is applied.
+REVERSE_FUTILITY_MAX_DEPTH = 3
+
+
+class SearchAborted(Exception):
+    """
+    Raised inside the search when we run out of time
+    or when the search is stopped.
+    """
 
 
-CACHE_KEY = Dict[Tuple[str, int, bool, float, float], Tuple[float | int, Optional[str]]]
+class SearchInfo(NamedTuple):
+    """
+    Result of a completed iterative deepening iteration.
+    """
+    depth: int
+    score: float
+    move: Optional[Move]
+    pv: List[Move]
+    nodes: int
+    time: float
+
+
+def mate_in(score: float, config: Config) -> Optional[int]:
+    """
+    Returns in how many moves the side to move mates for checkmate scores,
+    negative if it gets mated, or None if the score isn't a checkmate.
+    """
+    if abs(score) <= config.checkmate_threshold:
+        return None
+    # mate scores lose one point per ply
+    moves = (config.checkmate_score - int(abs(score)) + 1) // 2
+    return moves if score > 0 else -moves
 
 
 class AlphaBeta:
@@ -19,6 +64,96 @@ class AlphaBeta:
     """
     def __init__(self, config: Config):
         self.config = config
+        self.cache = TranspositionTable(self.config.hash_size)
+        self.move_ordering = MoveOrdering()
+        self.evaluation = IncrementalEvaluation()
+        self.tablebase: Optional[TablebaseProber] = None
+        if self.config.syzygy_path:
+            self.tablebase = TablebaseProber(
+                self.config.syzygy_path, self.config.syzygy_pieces, self.config.syzygy_cache_size,
+            )
+        self.deadline: Optional[float] = None
+        self.nodes = 0
+        # set to stop the running search
+        self.stop_event: Union[threading.Event, ProcessEvent] = threading.Event()
+        # the move at this position of the ordered root moves is
+        # searched first, so parallel helpers explore different trees
+        self.root_move_offset = 0
+        # root moves skipped by the search, e.g. the best moves
+        # of the previous lines when searching several of them
+        self.excluded_root_moves: List[Move] = []
+        # last iteration completed by the current (or last) search
+        self.last_search: Optional[SearchInfo] = None
+        # called with the lines of each completed iteration, e.g.
+        # to report the progress of the search while it runs
+        self.on_iteration: Optional[Callable[[List[SearchInfo]], None]] = None
+        # best root move found so far by the running iteration, played
+        # if the search is aborted before the first iteration completes
+        self.root_best_move: Optional[Move] = None
+
+    def warm_up(self):
+        """
+        Loads what the first search would otherwise load on demand:
+        the tablebase files and the evaluation of a starting position.
+        """
+        if self.tablebase is not None:
+            self.tablebase.open()
+        self.evaluation.reset(Board())
+        self.eval_board(Board())
+
+    def stop(self):
+        """
+        Stops the running search, which returns the best move found so far.
+        The engine doesn't search again until `clear_stop` is called.
+        """
+        self.stop_event.set()
+
+    def clear_stop(self):
+        """
+        Allows the engine to search again after `stop`.
+        """
+        self.stop_event.clear()
+
+    def clear(self):
+        """
+        Forgets everything learned in previous searches (transposition
+        table and move ordering), e.g. when a new game starts.
+        """
+        self.cache.clear()
+        self.move_ordering.clear()
+
+    def new_search(self):
+        """
+        Marks the start of a new search, entries from previous
+        searches in the transposition table become replaceable.
+        """
+        self.cache.new_search()
+        self.move_ordering.new_search()
+
+    def close(self):
+        """
+        Releases the resources held by the engine.
+        """
+
+    def configure(self, config: Config):
+        """
+        Applies the search options (`SEARCH_OPTIONS`) of the configuration
+        to the engine, e.g. between the searches of different requests.
+        When they change, what was learned in previous searches is forgotten,
+        so results don't depend on searches made with other options.
+        """
+        if self.apply_search_options({field: getattr(config, field) for field in SEARCH_OPTIONS}):
+            self.clear()
+
+    def apply_search_options(self, options: Dict[str, Any]) -> bool:
+        """
+        Replaces the configuration of the engine with one using the given
+        search options, and returns True if any of them changed.
+        """
+        if all(getattr(self.config, field) == value for field, value in options.items()):
+            return False
+        self.config = replace(self.config, **options)
+        return True
 
     def random_move(self, board: Board) -> Move:
         move = choice([move for move in board.legal_moves])
@@ -35,18 +170,49 @@ class AlphaBeta:
         Returns:
             - score: the score for the current board
         """
-        pieces = sum(count_pieces(board))
+        evaluation = self.evaluation.evaluate(board.turn)
 
-        if pieces <= self.config.syzygy_pieces and self.config.syzygy_path:
-            with chess.syzygy.open_tablebase(self.config.syzygy_path) as tablebase:
-                try:
-                    eval = tablebase.probe_dtz(board)
-                    return eval
-                except (chess.syzygy.MissingTableError, KeyError):
-                    # syzygy tablebase position not found, continue with evaluation
-                    pass
+        if self.tablebase is not None:
+            tablebase_score = self.tablebase.score(board)
+            if tablebase_score == 0:
+                return 0
+            if tablebase_score is not None:
+                # static evaluation breaks ties between won
+                # positions, so we keep making progress
+                return tablebase_score + evaluation
+
+        return evaluation
+
+    def make_move(self, board: Board, move: Move):
+        """
+        Pushes a move to the board, updating the incremental evaluation.
+        """
+        self.evaluation.push(board, move)
+        board.push(move)
 
-        return board_evaluation(board)
+    def unmake_move(self, board: Board):
+        """
+        Takes back the last move, restoring the incremental evaluation.
+        """
+        board.pop()
+        self.evaluation.pop()
+
+    def check_time(self):
+        """
+        Counts a searched node and aborts the search once
+        the deadline is reached or the search is stopped.
+        """
+        self.nodes += 1
+        if self.nodes % NODES_BETWEEN_TIME_CHECKS == 0 and self.stopped():
+            raise SearchAborted()
+
+    def stopped(self) -> bool:
+        """
+        Returns True if the search was stopped or the deadline was reached.
+        """
+        if self.stop_event.is_set():
+            return True
+        return self.deadline is not None and time.monotonic() >= self.deadline
 
     def quiescence_search(
         self, board: Board, depth: int, alpha: float, beta: float,
@@ -70,6 +236,8 @@ class AlphaBeta:
         Returns:
             - best_score: returns best move's score.
         """
+        self.check_time()
+
         if board.is_stalemate():
             return 0
 
@@ -86,6 +254,11 @@ class AlphaBeta:
         if stand_pat >= beta:
             return beta
 
+        # delta pruning, even capturing a queen can't raise alpha
+        delta_pruning = self.config.delta_pruning and not board.is_check()
+        if delta_pruning and stand_pat + MG_PIECE_VALUES[chess.QUEEN] + self.config.delta_margin < alpha:
+            return alpha
+
         # alpha update
         alpha = max(alpha, stand_pat)
 
@@ -93,14 +266,25 @@ class AlphaBeta:
         moves = organize_moves_quiescence(board)
 
         for move in moves:
+            if not move.promotion and board.is_capture(move):
+                # delta pruning, capturing this piece can't raise alpha
+                if delta_pruning:
+                    captured = board.piece_type_at(move.to_square) or chess.PAWN
+                    if stand_pat + MG_PIECE_VALUES[captured] + self.config.delta_margin <= alpha:
+                        continue
+
+                # skip captures that lose material
+                if self.config.see_pruning and static_exchange_evaluation(board, move) < 0:
+                    continue
+
             # make move and get score
-            board.push(move)
+            self.make_move(board, move)
             score = -self.quiescence_search(
                 board=board,
                 depth=depth - 1,
                 alpha=-beta,
                 beta=-alpha,)
-            board.pop()
+            self.unmake_move(board)
 
             # beta-cutoff
             if score >= beta:
@@ -116,10 +300,11 @@ class AlphaBeta:
         board: Board,
         depth: int,
         null_move: bool,
-        cache: DictProxy | CACHE_KEY,
+        cache: TranspositionTable,
         alpha: float = float("-inf"),
         beta: float = float("inf"),
-    ) -> Tuple[float | int, Optional[str]]:
+        ply: int = 0,
+    ) -> Tuple[float, Optional[Move]]:
         """
         This functions receives a board, depth and a player; and it returns
         the best move for the current board based on how many depths we're looking ahead
@@ -139,28 +324,33 @@ class AlphaBeta:
             - board: chess board state
             - depth: how many depths we want to calculate for this board
             - null_move: if we want to use null move pruning
-            - cache: a shared hash table to store the best
+            - cache: transposition table to store the score, bound and best
                 move for each board state and depth.
             - alpha: best score for the maximizing player (best choice
                 (highest value)  we've found along the path for max)
             - beta: best score for the minimizing player (best choice
                 (lowest value) we've found along the path for min).
+            - ply: distance from the root of the search.
 
         Returns:
             - best_score, best_move: returns best move that it found and its value.
         """
-        cache_key = (board.fen(), depth, null_move, alpha, beta)
-        # check if board was already evaluated
-        if cache_key in cache:
-            return cache[cache_key]
+        self.check_time()
 
-        if board.is_checkmate():
-            cache[cache_key] = (-self.config.checkmate_score, None)
-            return (-self.config.checkmate_score, None)
+        # evaluation is updated incrementally from the root of the search
+        if ply == 0:
+            self.evaluation.reset(board)
 
-        if board.is_stalemate():
-            cache[cache_key] = (0, None)
-            return (0, None)
+        alpha_orig = alpha
+        key = cache.key(board)
+
+        # when searching the next MultiPV line, the root entry
+        # belongs to the previous line, so it's only used for ordering
+        excluding = ply == 0 and bool(self.excluded_root_moves)
+
+        result, hash_move = self.probe_node(board, key, depth, alpha, beta, cache, excluding)
+        if result is not None:
+            return result
 
         # recursion base case
         if depth <= 0:
@@ -171,62 +361,140 @@ class AlphaBeta:
                 alpha=alpha,
                 beta=beta,
             )
-            cache[cache_key] = (board_score, None)
+            cache.store(key, 0, board_score, self.bound(board_score, alpha_orig, beta), None)
             return board_score, None
 
+        in_check = board.is_check()
+        # mate scores can't be pruned based on the static evaluation
+        prunable = ply > 0 and not in_check and abs(beta) < self.config.checkmate_threshold
+
+        # reverse futility pruning, our position is so good that
+        # even with a margin for each ply left we would beat beta
+        if self.config.reverse_futility and prunable and depth <= REVERSE_FUTILITY_MAX_DEPTH:
+            static_eval = self.eval_board(board)
+            if static_eval - self.config.reverse_futility_margin * depth >= beta:
+                return static_eval, None
+
         # null move prunning
-        if self.config.null_move and depth >= (self.config.null_move_r + 1) and not board.is_check():
+        if self.config.null_move and depth >= (self.config.null_move_r + 1) and not in_check:
             board_score = self.eval_board(board)
             if board_score >= beta:
-                board.push(Move.null())
+                self.make_move(board, Move.null())
                 board_score = -self.negamax(
                     board=board,
                     depth=depth - 1 - self.config.null_move_r,
                     null_move=False,
                     cache=cache,
                     alpha=-beta,
-                    beta=-beta + 1
+                    beta=-beta + 1,
+                    ply=ply + 1,
                 )[0]
-                board.pop()
+                self.unmake_move(board)
                 if board_score >= beta:
-                    cache[cache_key] = (beta, None)
+                    cache.store(key, depth, beta, LOWER, None)
                     return beta, None
 
+        # futility pruning, at frontier nodes quiet moves
+        # can't raise alpha if our position is bad enough
+        futility_pruning = False
+        if self.config.futility and prunable and depth <= FUTILITY_MAX_DEPTH:
+            if abs(alpha) < self.config.checkmate_threshold:
+                static_eval = self.eval_board(board)
+                futility_pruning = static_eval + self.config.futility_margin * depth <= alpha
+
         best_move = None
 
         # initializing best_score
         best_score = float("-inf")
-        moves = organize_moves(board)
+        moves = self.move_ordering.organize_moves(board, ply, hash_move)
+        if excluding:
+            moves = [move for move in moves if move not in self.excluded_root_moves]
+        if ply == 0 and self.root_move_offset:
+            moves.insert(0, moves.pop(self.root_move_offset % len(moves)))
+
+        for move_index, move in enumerate(self.search_order(board, moves, depth)):
+            quiet = not (move.promotion or board.is_capture(move))
+            if futility_pruning and move_index > 0 and quiet and not board.gives_check(move):
+                continue
 
-        for move in moves:
             # make the move
-            board.push(move)
+            self.make_move(board, move)
+
+            # late move reductions: with good move ordering, late quiet moves
+            # are unlikely to be good, so we first search them with less depth
+            # and only search them fully if they beat alpha
+            full_search = True
+            late_move = move_index >= self.config.lmr_min_moves and depth >= self.config.lmr_min_depth
+            if self.config.lmr and late_move and quiet and not in_check and not board.is_check():
+                board_score = -self.negamax(
+                    board=board,
+                    depth=depth - 1 - self.config.lmr_reduction,
+                    null_move=null_move,
+                    cache=cache,
+                    alpha=-alpha - 1,
+                    beta=-alpha,
+                    ply=ply + 1,
+                )[0]
+                full_search = board_score > alpha
 
-            board_score = -self.negamax(
-                board=board,
-                depth=depth - 1,
-                null_move=null_move,
-                cache=cache,
-                alpha=-beta,
-                beta=-alpha
-            )[0]
+            if full_search and self.config.pvs and move_index > 0:
+                # principal variation search: we expect the first move to be
+                # the best one, so we only try to prove the other moves are worse
+                # with a null window, and re-search them if that fails
+                board_score = -self.negamax(
+                    board=board,
+                    depth=depth - 1,
+                    null_move=null_move,
+                    cache=cache,
+                    alpha=-alpha - 1,
+                    beta=-alpha,
+                    ply=ply + 1,
+                )[0]
+                if alpha < board_score < beta:
+                    board_score = -self.negamax(
+                        board=board,
+                        depth=depth - 1,
+                        null_move=null_move,
+                        cache=cache,
+                        alpha=-beta,
+                        beta=-alpha,
+                        ply=ply + 1,
+                    )[0]
+            elif full_search:
+                board_score = -self.negamax(
+                    board=board,
+                    depth=depth - 1,
+                    null_move=null_move,
+                    cache=cache,
+                    alpha=-beta,
+                    beta=-alpha,
+                    ply=ply + 1,
+                )[0]
             if board_score > self.config.checkmate_threshold:
                 board_score -= 1
             if board_score < -self.config.checkmate_threshold:
                 board_score += 1
 
             # take move back
-            board.pop()
+            self.unmake_move(board)
 
             # beta-cutoff
             if board_score >= beta:
-                cache[cache_key] = (board_score, move)
+                # remember quiet moves that caused cutoffs to try them earlier
+                if quiet:
+                    self.move_ordering.update(board, move, depth, ply)
+                if not excluding:
+                    cache.store(key, depth, board_score, LOWER, move)
+                if ply == 0:
+                    self.root_best_move = move
                 return board_score, move
 
             # update best move
             if board_score > best_score:
                 best_score = board_score
                 best_move = move
+                if ply == 0:
+                    self.root_best_move = move
 
             # setting alpha variable to do pruning
             alpha = max(alpha, board_score)
@@ -238,15 +506,294 @@ class AlphaBeta:
                 break
 
         # if no best move, make a random one
-        if not best_move:
-            best_move = self.random_move(board).uci()
+        if best_move is None:
+            best_move = self.random_move(board)
 
         # save result before returning
-        cache[cache_key] = (best_score, best_move)
+        if not excluding:
+            cache.store(key, depth, best_score, self.bound(best_score, alpha_orig, beta), best_move)
         return best_score, best_move
 
-    def search_move(self, board: Board) -> Optional[str]:
-        # create shared cache
-        cache: CACHE_KEY = {}
+    def search_order(self, board: Board, moves: List[Move], depth: int) -> Iterable[Move]:
+        """
+        Returns the moves of a node in the order they're searched, engines
+        override it to decide the order during the search (e.g. ABDADA).
+        The board is at the node whenever the next move is taken.
+
+        Arguments:
+            - board: chess board state.
+            - moves: ordered moves of the node.
+            - depth: depth of the node.
+
+        Returns:
+            - moves: the moves to search.
+        """
+        return moves
+
+    def probe_node(
+        self,
+        board: Board,
+        key: int,
+        depth: int,
+        alpha: float,
+        beta: float,
+        cache: TranspositionTable,
+        excluding: bool,
+    ) -> Tuple[Optional[Tuple[float, Optional[Move]]], Optional[Move]]:
+        """
+        Resolves the nodes that don't need their moves searched: boards already
+        evaluated with enough depth in the transposition table, and boards
+        where the game is over.
+
+        Arguments:
+            - board: chess board state.
+            - key: key of the board in the transposition table.
+            - depth: how many depths we want to calculate for this board.
+            - alpha: lower bound of the search window.
+            - beta: upper bound of the search window.
+            - cache: transposition table.
+            - excluding: if root moves are excluded, so the entry of the board
+                is only used for move ordering.
+
+        Returns:
+            - result, hash_move: score and best move of the node if it's
+                resolved (None otherwise), and the move to search first.
+        """
+        # check if board was already evaluated with enough depth
+        entry = cache.probe(key)
+        hash_move = entry.move if entry is not None else None
+        if entry is not None and entry.depth >= depth and not excluding:
+            if entry.bound == EXACT:
+                return (entry.score, entry.move), hash_move
+            if entry.bound == LOWER and entry.score >= beta:
+                return (entry.score, entry.move), hash_move
+            if entry.bound == UPPER and entry.score <= alpha:
+                return (entry.score, entry.move), hash_move
+
+        if board.is_checkmate():
+            cache.store(key, depth, -self.config.checkmate_score, EXACT, None)
+            return (-self.config.checkmate_score, None), hash_move
+
+        if board.is_stalemate():
+            cache.store(key, depth, 0, EXACT, None)
+            return (0, None), hash_move
+
+        return None, hash_move
+
+    @staticmethod
+    def bound(score: float, alpha: float, beta: float) -> int:
+        """
+        Returns the bound type of a score found with the (alpha, beta) window.
+        """
+        if score <= alpha:
+            return UPPER
+        if score >= beta:
+            return LOWER
+        return EXACT
+
+    def principal_variation(self, board: Board, depth: int) -> List[Move]:
+        """
+        Follows the best moves stored in the transposition table
+        to build the principal variation of the last search.
+
+        Arguments:
+            - board: chess board state.
+            - depth: maximum length of the variation.
+
+        Returns:
+            - pv: list of moves, starting with the best move for the board.
+        """
+        pv: List[Move] = []
+        board = board.copy(stack=False)
+        while len(pv) < depth:
+            entry = self.cache.probe(self.cache.key(board))
+            if entry is None or entry.move is None or not board.is_legal(entry.move):
+                break
+            pv.append(entry.move)
+            board.push(entry.move)
+        return pv
+
+    def root_search(
+        self, board: Board, depth: int, alpha: float = float("-inf"), beta: float = float("inf"),
+    ) -> Tuple[float | int, Optional[Move]]:
+        """
+        Searches the root of each iteration of the iterative deepening,
+        engines override it to search the root differently (e.g. in parallel).
+
+        Arguments:
+            - board: chess board state.
+            - depth: depth to search.
+            - alpha: lower bound of the search window.
+            - beta: upper bound of the search window.
+
+        Returns:
+            - best_score, best_move: returns best move that it found and its value.
+        """
+        return self.negamax(board, depth, self.config.null_move, self.cache, alpha, beta)
+
+    def aspiration_search(
+        self, board: Board, depth: int, previous_score: float,
+    ) -> Tuple[float | int, Optional[Move]]:
+        """
+        Searches the root with a narrow window around the score of the
+        previous iteration, which prunes more than a full window search.
+        When the score falls outside the window we widen it and search again.
+
+        Arguments:
+            - board: chess board state.
+            - depth: depth to search.
+            - previous_score: score found by the previous iteration.
+
+        Returns:
+            - best_score, best_move: returns best move that it found and its value.
+        """
+        delta = self.config.aspiration_window
+        alpha = previous_score - delta
+        beta = previous_score + delta
+
+        # mate scores are too far from regular ones, search with a full window
+        if abs(previous_score) > self.config.checkmate_threshold:
+            alpha, beta = float("-inf"), float("inf")
+
+        while True:
+            score, move = self.root_search(board, depth, alpha, beta)
+
+            if score <= alpha:
+                # fail low, widen window down
+                delta *= 2
+                alpha = score - delta if delta < self.config.checkmate_threshold else float("-inf")
+            elif score >= beta:
+                # fail high, widen window up
+                delta *= 2
+                beta = score + delta if delta < self.config.checkmate_threshold else float("inf")
+            else:
+                return score, move
+
+    def iterative_deepening(
+        self, board: Board, depth: Optional[int] = None, time_limit: Optional[float] = None, lines: int = 1,
+    ) -> Iterator[SearchInfo]:
+        """
+        Searches the board with increasing depths, so results from
+        shallower searches (stored in the transposition table) improve
+        move ordering of deeper ones. The search stops at the given depth
+        or when the time limit is reached; the iteration that's running
+        at the deadline is discarded.
+
+        Several lines can be searched (MultiPV): at each depth they're
+        searched one after the other, each one excluding the root moves
+        of the previous lines. Every line of a completed iteration is
+        sent to `on_iteration`, if it's set.
+
+        Arguments:
+            - board: chess board state.
+            - depth: maximum depth to search, defaults to the configured
+                depth, or to MAX_DEPTH when searching with a time limit.
+            - time_limit: how many seconds we can search for.
+            - lines: how many lines we want to find.
+
+        Returns:
+            - info: the best line of each completed iteration.
+        """
+        self.new_search()
+        return self.search_iterations(board, depth, time_limit, lines)
+
+    def search_iterations(
+        self, board: Board, depth: Optional[int] = None, time_limit: Optional[float] = None, lines: int = 1,
+    ) -> Iterator[SearchInfo]:
+        """
+        Same as `iterative_deepening`, but it doesn't start a new search in
+        the transposition table and move ordering, e.g. for parallel helpers
+        joining a search that was already started.
+        """
+        if depth is None:
+            depth = MAX_DEPTH if time_limit is not None else self.config.negamax_depth
+        # each line has its own root move
+        lines = max(min(lines, board.legal_moves.count()), 1)
+
+        self.nodes = 0
+        self.last_search = None
+        self.root_best_move = None
+        start = time.monotonic()
+        self.deadline = None if time_limit is None else start + time_limit
+        stack_size = len(board.move_stack)
+        score: float = 0
+
+        try:
+            for current_depth in range(1, depth + 1):
+                iteration: List[SearchInfo] = []
+                try:
+                    for line in range(lines):
+                        self.excluded_root_moves = [info.move for info in iteration if info.move is not None]
+                        if self.config.aspiration and current_depth > 1 and line == 0:
+                            line_score, move = self.aspiration_search(board, current_depth, score)
+                        else:
+                            line_score, move = self.root_search(board, current_depth)
+                        iteration.append(SearchInfo(
+                            depth=current_depth,
+                            score=line_score,
+                            move=move,
+                            pv=self.line_variation(board, move, current_depth),
+                            nodes=self.nodes,
+                            time=time.monotonic() - start,
+                        ))
+                except SearchAborted:
+                    # take back the moves of the unfinished search
+                    while len(board.move_stack) > stack_size:
+                        board.pop()
+                    return
+
+                score = iteration[0].score
+                self.last_search = iteration[0]
+                if self.on_iteration is not None:
+                    self.on_iteration(iteration)
+                yield self.last_search
+
+                if time_limit is not None and iteration[-1].time >= time_limit * ITERATION_TIME_RATIO:
+                    return
+        finally:
+            self.excluded_root_moves = []
+            self.deadline = None
+
+    def line_variation(self, board: Board, move: Optional[Move], depth: int) -> List[Move]:
+        """
+        Returns the principal variation of a line starting with the given
+        root move. The root entry of the table only has the best line.
+        """
+        if move is None:
+            return []
+        board.push(move)
+        pv = [move] + self.principal_variation(board, depth - 1)
+        board.pop()
+        return pv
+
+    def search_move(
+        self, board: Board, depth: Optional[int] = None, time_limit: Optional[float] = None,
+    ) -> Optional[Move]:
+        """
+        Returns the best move found by the last completed
+        iteration of the iterative deepening search.
+
+        Arguments:
+            - board: chess board state.
+            - depth: maximum depth to search.
+            - time_limit: how many seconds we can search for.
 
-        return self.negamax(board, copy(self.config.negamax_depth), self.config.null_move, cache)[1]
+        Returns:
+            - move: the best move found.
+        """
+        best_move = None
+        for info in self.iterative_deepening(board, depth, time_limit, self.config.multi_pv):
+            best_move = info.move
+        if best_move is None:
+            best_move = self.fallback_move(board)
+        return best_move
+
+    def fallback_move(self, board: Board) -> Optional[Move]:
+        """
+        Returns the move to play when the search was aborted before its
+        first iteration completed: the best root move found so far, or
+        the first legal move if no root move was searched.
+        """
+        if self.root_best_move is not None:
+            return self.root_best_move
+        return next(iter(board.legal_moves), None)
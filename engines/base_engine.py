@@ -1,7 +1,8 @@
 from abc import abstractmethod
-from typing import Optional
+from typing import Callable, List, Optional
 
 from config import Config
+from engines.alpha_beta import SearchInfo
 
 from chess import Board
 
@@ -17,22 +18,67 @@ class ChessEngine(Protocol):
         - search_move: returns the best move for
         the current board based on how many depths
         we're looking ahead.
+        - stop: stops the running search.
+        - clear_stop: allows the engine to search again after stop.
+        - clear: forgets what was learned in previous searches.
+        - configure: applies the search options of a configuration.
+        - close: releases the resources held by the engine.
+
+    Attributes:
+        - on_iteration: if set, called with the lines found by each
+        completed iteration of the search, e.g. to report its progress.
     """
+    on_iteration: Optional[Callable[[List[SearchInfo]], None]]
+
     def __init__(self, config: Config):
         ...
 
     @abstractmethod
-    def search_move(self, board: Board, depth: int, null_move: bool) -> Optional[str]:
+    def search_move(
+        self, board: Board, depth: Optional[int] = None, time_limit: Optional[float] = None,
+    ) -> Optional[str]:
         """
         We'll search for the best possible move in the board that we're
-        receiving up to a given depth.
+        receiving up to a given depth or time limit.
 
         Arguments:
             - board: chess board state.
-            - depth: maximum depth to search.
-            - null_move: if we're using null move pruning in our search.
+            - depth: maximum depth to search, defaults to the configured depth.
+            - time_limit: how many seconds we can search for.
 
         Returns:
             - move: the best move found.
         """
         raise NotImplementedError()
+
+    def stop(self):
+        """
+        Stops the running search (e.g. from another thread),
+        which returns the best move found so far.
+        """
+        ...
+
+    def clear_stop(self):
+        """
+        Allows the engine to search again after `stop`.
+        """
+        ...
+
+    def clear(self):
+        """
+        Forgets what was learned in previous searches, e.g. when a new game starts.
+        """
+        ...
+
+    def configure(self, config: Config):
+        """
+        Applies the search options of the configuration (e.g. null move
+        pruning), without creating the engine and its workers again.
+        """
+        ...
+
+    def close(self):
+        """
+        Releases the resources held by the engine, e.g. worker processes.
+        """
+        ...
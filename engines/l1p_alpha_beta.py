@@ -1,46 +1,104 @@
-from copy import copy
-from multiprocessing import Manager, Pool, cpu_count
+import time
+from typing import Optional
 
 import chess
 
-from engines.alpha_beta import AlphaBeta
+from engines.alpha_beta import SearchAborted, SearchInfo
+from engines.parallel_alpha_beta import ParallelAlphaBeta
+from transposition_table import EXACT
 
 
-class Layer1ParallelAlphaBeta(AlphaBeta):
+class Layer1ParallelAlphaBeta(ParallelAlphaBeta):
     """
     This class implements a parallel search
     algorithm starting from the first layer.
+
+    The first (best ordered) root move is searched first, to get
+    a good bound. The other root moves are then dispatched to the
+    workers as they become free, searched with a null window around
+    the best score found so far (shared by all workers), and only
+    re-searched with a full window when they might be better.
+
+    The search isn't iterative, when the time limit is reached (or it's
+    stopped) the workers are stopped and the best root move searched so
+    far is played. `last_search` is only set (and sent to `on_iteration`)
+    when every root move was searched.
     """
 
-    def search_move(self, board: chess.Board) -> str:
-        # start multiprocessing
-        nprocs = cpu_count()
-        pool = Pool(processes=nprocs)
-        manager = Manager()
-        shared_cache = manager.dict()
+    def search_move(
+        self, board: chess.Board, depth: Optional[int] = None, time_limit: Optional[float] = None,
+    ) -> Optional[chess.Move]:
+        if depth is None:
+            depth = self.config.negamax_depth
+        self.new_search()
+        self.nodes = 0
+        self.last_search = None
+        start = time.monotonic()
+        self.deadline = None if time_limit is None else start + time_limit
+        try:
+            best_move = self.search_root_moves(board, depth, start)
+        finally:
+            self.deadline = None
+        if self.last_search is not None and self.on_iteration is not None:
+            self.on_iteration([self.last_search])
+        return best_move
+
+    def search_root_moves(self, board: chess.Board, depth: int, start: float) -> Optional[chess.Move]:
+        """
+        Searches the root moves, the first one in this process and the
+        others in the workers, until they're all searched or the search
+        is aborted.
 
+        Arguments:
+            - board: chess board state.
+            - depth: depth to search.
+            - start: time (as given by time.monotonic) the search started.
+
+        Returns:
+            - move: the best move found.
+        """
         # creating list of moves at layer 1
-        moves = list(board.legal_moves)
-        arguments = []
-        for move in moves:
-            board.push(move)
-            arguments.append(
-                (copy(board),
-                 copy(self.config.negamax_depth) - 1,
-                 self.config.null_move,
-                 shared_cache))
-            board.pop()
-
-        # executing all the moves at layer 1 in parallel
-        # starmap blocks until all process are done
-        processes = pool.starmap(self.negamax, arguments)
-        results = []
-
-        # inserting move information in the results
-        for i in range(len(processes)):
-            results.append((*processes[i], moves[i]))
-
-        # sorting results and getting best move
-        results.sort(key=lambda a: a[0])
-        best_move = results[0][2]
+        key = self.cache.key(board)
+        entry = self.cache.probe(key)
+        moves = self.move_ordering.organize_moves(board, 0, entry.move if entry is not None else None)
+        if not moves:
+            return None
+
+        # searching the first move to get a bound for the others
+        best_move = moves[0]
+        stack_size = len(board.move_stack)
+        self.evaluation.reset(board)
+        self.make_move(board, best_move)
+        try:
+            best_score = -self.negamax(board, depth - 1, self.config.null_move, self.cache, ply=1)[0]
+        except SearchAborted:
+            # stopped before we have a score, take back the moves of the search
+            # and play the first move, which move ordering expects to be the best
+            while len(board.move_stack) > stack_size:
+                board.pop()
+            return best_move
+        self.unmake_move(board)
+        best_score = self.mate_distance(best_score)
+
+        # executing the other moves at layer 1 in parallel,
+        # results arrive in the order the workers finish them
+        try:
+            for move, score in self.search_moves_in_parallel(
+                board, moves[1:], depth, best_score, float("inf"), ply=0,
+            ):
+                if score > best_score:
+                    best_score, best_move = score, move
+        except SearchAborted:
+            # stopped, the best move among the searched ones is kept
+            return best_move
+
+        self.cache.store(key, depth, best_score, EXACT, best_move)
+        self.last_search = SearchInfo(
+            depth=depth,
+            score=best_score,
+            move=best_move,
+            pv=self.principal_variation(board, depth),
+            nodes=self.nodes,
+            time=time.monotonic() - start,
+        )
         return best_move
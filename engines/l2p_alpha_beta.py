@@ -1,14 +1,14 @@
+import time
 from collections import defaultdict
-from copy import copy
-from multiprocessing import Manager, Pool, cpu_count
-from multiprocessing.managers import DictProxy
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from config import Config
 from functools import partial
 
-from chess import Board
+from chess import Board, Move
 
-from engines.alpha_beta import AlphaBeta
+from engines.alpha_beta import SearchInfo
+from engines.parallel_alpha_beta import WAIT_INTERVAL, ParallelAlphaBeta, pack_board, worker_negamax
+from transposition_table import pack_move
 
 
 def LAYER_SIGNAL_CORRECTION(data):
@@ -23,7 +23,7 @@ def CHECKMATE_CORRECTION(data, threshold):
     )
 
 
-class Layer2ParallelAlphaBeta(AlphaBeta):
+class Layer2ParallelAlphaBeta(ParallelAlphaBeta):
     """
     This class implements a parallel search
     algorithm starting from the second layer.
@@ -32,95 +32,90 @@ class Layer2ParallelAlphaBeta(AlphaBeta):
         super().__init__(config)
         self.checkmate_correction = partial(CHECKMATE_CORRECTION, threshold=self.config.checkmate_threshold)
 
-    def generate_board_and_moves(
-        self, og_board: Board, board_to_move_that_generates_it: DictProxy, layer: int
-    ) -> List[Tuple[Board, Board, int]]:
+    def generate_paths(self, board: Board) -> List[Tuple[Move, ...]]:
         """
-        Generate all possible boards with their layer depth for each board.
+        Generates the move paths from the board to every position two moves
+        ahead. If the game ends after the first move, the path stops there.
 
         Args:
-            og_board: Board to generate moves for.
-            board_to_move_that_generates_it: Dictionary that maps board to move that generates it.
-            layer: Layer depth of the board.
+            board: Board to generate moves for.
 
         Returns:
-            List of tuples with:
-                - generated board (original board with move applied)
-                - original board
-                - layer depth
+            List of paths, each one with the first layer move followed by
+            the second layer move (if any).
         """
-        boards_and_moves = []
-        board = copy(og_board)
-
-        # if board has no legal moves, we leave it as is
-        # we need to run this board through negamax to get its value
-        if not og_board.legal_moves:
-            boards_and_moves.append((og_board, og_board, layer))
-
-        # get first layer move that generates current board
-        first_move = board_to_move_that_generates_it.get(og_board.fen())
-
-        # generating all possible moves
+        paths: List[Tuple[Move, ...]] = []
         for move in board.legal_moves:
-
             board.push(move)
-
-            # save first layer move that generates current board
-            if first_move:
-                board_to_move_that_generates_it[board.fen()] = first_move
-            else:
-                board_to_move_that_generates_it[board.fen()] = move
-            # add new board, original board, and current layer to our output
-            boards_and_moves.append((copy(board), og_board, layer + 1))
-
+            replies = list(board.legal_moves)
             board.pop()
 
-        return boards_and_moves
-
-    def search_move(self, board: Board) -> str:
+            # if board has no legal moves, we leave it as is
+            # we need to run this board through negamax to get its value
+            if not replies:
+                paths.append((move,))
+            else:
+                paths.extend((move, reply) for reply in replies)
+        return paths
+
+    def search_move(
+        self, board: Board, depth: Optional[int] = None, time_limit: Optional[float] = None,
+    ) -> Optional[Move]:
+        if depth is None:
+            depth = self.config.negamax_depth
         START_LAYER = 2
-        # start multiprocessing
-        nprocs = cpu_count()
-        pool = Pool(processes=nprocs)
-        manager = Manager()
-        shared_cache = manager.dict()
-
-        # pointer that help us in finding the best next move
-        board_to_move_that_generates_it = manager.dict()
-
-        # starting board list
-        board_list = [(board, board, 0)]
-
-        # generating all possible boards for up to 2 moves ahead
-        for _ in range(START_LAYER):
-            arguments = [
-                (board, board_to_move_that_generates_it, layer)
-                for board, _, layer in board_list
-            ]
-            processes = pool.starmap(self.generate_board_and_moves, arguments)
-            board_list = [board for board in sum(processes, [])]
-
+        self.new_search()
+        self.nodes = 0
+        self.last_search = None
+        self.root_best_move = None
+        start = time.monotonic()
+
+        # generating all possible boards for up to 2 moves ahead, the
+        # path to each board tells us the first move that generates it
+        paths = self.generate_paths(board)
+        if not paths:
+            return None
+
+        # workers rebuild each board from the packed root board and its path
+        position = pack_board(board)
         negamax_arguments = [
-            (board, copy(self.config.negamax_depth) - START_LAYER, self.config.null_move, shared_cache)
-            for board, _, _ in board_list
+            (position, tuple(pack_move(move) for move in path), depth - START_LAYER, self.config.null_move)
+            for path in paths
         ]
 
-        parallel_layer_result = pool.starmap(self.negamax, negamax_arguments)
-
-        # grouping output based on the  board that generates it
+        assert self.pool is not None
+        results = self.pool.starmap_async(worker_negamax, negamax_arguments)
+        self.deadline = None if time_limit is None else start + time_limit
+        try:
+            while not results.ready():
+                results.wait(WAIT_INTERVAL)
+                if self.stopped():
+                    # boards the workers didn't finish have no score
+                    self.stop_workers(results.wait)
+        finally:
+            self.deadline = None
+        parallel_layer_result = results.get()
+
+        # grouping output based on the first move that generates it
         groups = defaultdict(list)
-
-        # adding information about the board and layer
-        # that generates the results and separating them
-        # into groups based on the root board
-        for i in range(len(parallel_layer_result)):
-            groups[board_list[i][1].fen()].append(
-                (*parallel_layer_result[i], board_list[i][0], board_list[i][2])
-            )
+        # first moves with boards that weren't searched
+        unfinished = set()
+
+        # adding information about the layer of the board
+        # and separating them into groups based on the first move
+        for path, (score, move, nodes) in zip(paths, parallel_layer_result):
+            self.nodes += nodes
+            if score is None:
+                unfinished.add(path[0])
+            else:
+                groups[path[0]].append((score, move, path, len(path)))
 
         best_boards = []
 
-        for group in groups.values():
+        for first_move, group in groups.items():
+            # every reply is needed to score the first move
+            if first_move in unfinished:
+                continue
             # layer and checkmate corrections
             # they are needed to adjust for
             # boards from different layers
@@ -130,11 +125,29 @@ class Layer2ParallelAlphaBeta(AlphaBeta):
             group.sort(key=lambda a: a[0])
             best_boards.append(group[0])
 
+        if not best_boards:
+            return self.fallback_move(board)
+
         # get best board
         best_boards.sort(key=lambda a: a[0], reverse=True)
-        best_board = best_boards[0][2].fen()
 
         # get move that results in best board
-        best_move = board_to_move_that_generates_it[best_board]
-
+        best_score, _, best_path, _ = best_boards[0]
+        best_move = best_path[0]
+
+        if not unfinished:
+            # the variation continues from the best board with the workers' table entries
+            best_board = board.copy(stack=False)
+            for move in best_path:
+                best_board.push(move)
+            self.last_search = SearchInfo(
+                depth=depth,
+                score=best_score,
+                move=best_move,
+                pv=list(best_path) + self.principal_variation(best_board, depth - len(best_path)),
+                nodes=self.nodes,
+                time=time.monotonic() - start,
+            )
+            if self.on_iteration is not None:
+                self.on_iteration([self.last_search])
         return best_move
@@ -1,36 +1,72 @@
-from multiprocessing import Manager, Pool, cpu_count
-
-from chess import Board
-
-from engines.alpha_beta import AlphaBeta
-from copy import copy
-
-
-class LazySMP(AlphaBeta):
-
-    def search_move(self, board: Board) -> str:
-        # start multiprocessing
-        nprocs = cpu_count()
-        pool = Pool(processes=nprocs)
-        manager = Manager()
-        shared_cache = manager.dict()
-        # executing all the moves at layer 1 in parallel
-        # starmap blocks until all process are done
-        pool.starmap(
-            self.negamax,
-            [(
-                board,
-                copy(self.config.negamax_depth),
-                self.config.null_move,
-                shared_cache,
-            ) for _ in range(nprocs)],
-        )
-
-        # return best move for our original board
-        return shared_cache[(
-            board.fen(),
-            self.config.negamax_depth,
-            self.config.null_move,
-            float("-inf"),
-            float("inf")
-        )][1]
+from typing import Optional, Tuple
+
+from chess import Board, Move
+
+from engines.alpha_beta import MAX_DEPTH
+from engines.parallel_alpha_beta import PackedBoard, ParallelAlphaBeta, pack_board, worker_helper_search
+
+
+class LazySMP(ParallelAlphaBeta):
+    """
+    Lazy SMP: the main search runs in this process while every pool
+    worker runs a helper search of the same position. They only
+    communicate through the shared transposition table and history.
+
+    Helpers are diversified so they don't repeat the main search: half
+    of them search one ply deeper and each one starts from a different
+    root move. They're stopped as soon as the main search finishes, and
+    the move comes from the deepest completed search. Only the main search
+    finds several lines (MultiPV).
+    """
+
+    def worker_processes(self, threads: int) -> int:
+        # the main search takes one of the threads
+        return threads - 1
+
+    def helper_arguments(
+        self, position: PackedBoard, depth: int, helper: int,
+    ) -> Tuple[PackedBoard, int, int]:
+        """
+        Returns the arguments of `worker_helper_search` for a helper
+        (numbered from 1): odd helpers search one ply deeper, and each
+        one starts from a different root move.
+        """
+        return position, depth + helper % 2, helper
+
+    def search_move(
+        self, board: Board, depth: Optional[int] = None, time_limit: Optional[float] = None,
+    ) -> Optional[Move]:
+        if depth is None:
+            depth = MAX_DEPTH if time_limit is not None else self.config.negamax_depth
+        self.new_search()
+
+        # tasks are sent by a background thread, so helpers get
+        # a packed copy of the board that the main search won't modify
+        position = pack_board(board)
+        helpers = []
+        if self.pool is not None:
+            helpers = [
+                self.pool.apply_async(worker_helper_search, self.helper_arguments(position, depth, helper))
+                for helper in range(1, self.processes + 1)
+            ]
+
+        main_result = None
+        try:
+            for main_result in self.search_iterations(board, depth, time_limit, self.config.multi_pv):
+                pass
+        finally:
+            # stop the helpers and wait until they're done,
+            # so the next search starts with idle workers
+            results = self.stop_workers(lambda: [helper.get() for helper in helpers])
+        self.nodes += sum(nodes for _, nodes in results)
+
+        # deepest completed search, preferring the main one on ties
+        completed = [result for result in [main_result, *(info for info, _ in results)] if result is not None]
+        if not completed:
+            return self.fallback_move(board)
+        deepest = max(completed, key=lambda result: result.depth)
+        self.last_search = deepest._replace(nodes=self.nodes)
+        # the main search already reported its own iterations
+        if deepest is not main_result and self.on_iteration is not None:
+            self.on_iteration([self.last_search])
+        return self.last_search.move
@@ -0,0 +1,415 @@
+import os
+from multiprocessing import TimeoutError, cpu_count, get_context
+from multiprocessing.pool import Pool
+from multiprocessing.sharedctypes import Synchronized
+from typing import Any, Callable, Generator, List, Optional, Sequence, Tuple, TypeVar
+
+from chess import BLACK, WHITE, Board, Move
+
+from config import SEARCH_OPTIONS, Config
+from engines.alpha_beta import AlphaBeta, SearchAborted, SearchInfo
+from move_ordering import MAX_PLY, MoveOrdering
+from shared_buffer import SharedBuffer
+from transposition_table import SharedTranspositionTable, pack_move, unpack_move
+
+# How often (in seconds) we check the clock while waiting for the workers.
+WAIT_INTERVAL = 0.01
+
+# Position sent to the workers: piece bitboards, color bitboards and
+# state flags (turn, castling rights, en passant square, clocks).
+PackedBoard = Tuple[int, ...]
+
+# Engine used by the tasks running in a pool worker, it's
+# set once when the worker starts and reused by every search.
+_worker_engine: Optional[AlphaBeta] = None
+
+T = TypeVar("T")
+
+
+def pack_board(board: Board) -> PackedBoard:
+    """
+    Packs the position of the board in a tuple of ints, which is much
+    smaller to pickle than the board (and its move stack) itself.
+    """
+    return (
+        board.pawns,
+        board.knights,
+        board.bishops,
+        board.rooks,
+        board.queens,
+        board.kings,
+        board.occupied_co[WHITE],
+        board.occupied_co[BLACK],
+        board.promoted,
+        board.turn,
+        board.castling_rights,
+        -1 if board.ep_square is None else board.ep_square,
+        board.halfmove_clock,
+        board.fullmove_number,
+    )
+
+
+def unpack_board(packed: PackedBoard, moves: Tuple[int, ...] = ()) -> Board:
+    """
+    Rebuilds a board packed with `pack_board`, and plays the given
+    moves (packed with `pack_move`) on it.
+    """
+    board = Board.empty()
+    (
+        board.pawns,
+        board.knights,
+        board.bishops,
+        board.rooks,
+        board.queens,
+        board.kings,
+        white,
+        black,
+        board.promoted,
+        turn,
+        board.castling_rights,
+        ep_square,
+        board.halfmove_clock,
+        board.fullmove_number,
+    ) = packed
+    board.occupied_co[WHITE] = white
+    board.occupied_co[BLACK] = black
+    board.occupied = white | black
+    board.turn = bool(turn)
+    board.ep_square = None if ep_square < 0 else ep_square
+    for code in moves:
+        move = unpack_move(code)
+        assert move is not None
+        board.push(move)
+    return board
+
+
+def set_cpu_affinity(cpus: Sequence[int]):
+    """
+    Restricts the current process to the given CPUs, where
+    the platform supports it (e.g. Linux).
+    """
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+
+def init_worker(engine: AlphaBeta, worker_counter: Synchronized):
+    """
+    Pool initializer, keeps the engine for the tasks
+    sent to this worker and warms it up.
+
+    Arguments:
+        - engine: engine used by the worker.
+        - worker_counter: shared counter used to number the workers,
+            so each one is pinned to a different CPU.
+    """
+    global _worker_engine
+    with worker_counter.get_lock():
+        index = worker_counter.value
+        worker_counter.value += 1
+
+    cpus = engine.config.cpu_affinity
+    if cpus:
+        set_cpu_affinity([cpus[index % len(cpus)]])
+
+    _worker_engine = engine
+    engine.warm_up()
+
+
+def worker_negamax(
+    board: PackedBoard, moves: Tuple[int, ...], depth: int, null_move: bool,
+) -> Tuple[Optional[float], Optional[Move], int]:
+    """
+    Runs negamax on the worker engine, using its shared transposition table.
+
+    Arguments:
+        - board: packed root position.
+        - moves: packed moves played from the root to the searched position.
+        - depth: how many depths we want to calculate for the position.
+        - null_move: if we want to use null move pruning.
+
+    Returns:
+        - best_score, best_move, nodes: result of negamax, None if the search
+            was stopped, and how many nodes the worker searched.
+    """
+    assert isinstance(_worker_engine, ParallelAlphaBeta)
+    # boards still queued when the search is stopped are skipped
+    if _worker_engine.stopped():
+        return None, None, 0
+    _worker_engine.load_search_options()
+    _worker_engine.nodes = 0
+    position = unpack_board(board, moves)
+    try:
+        score, move = _worker_engine.negamax(position, depth, null_move, _worker_engine.cache)
+    except SearchAborted:
+        return None, None, _worker_engine.nodes
+    return score, move, _worker_engine.nodes
+
+
+def worker_helper_search(
+    board: PackedBoard, depth: int, root_move_offset: int,
+) -> Tuple[Optional[SearchInfo], int]:
+    """
+    Runs a helper search on the worker engine, joining the search
+    started by the main process, until it reaches the given depth
+    or it's stopped.
+
+    Arguments:
+        - board: packed chess board state.
+        - depth: maximum depth to search.
+        - root_move_offset: which of the ordered root moves is searched first.
+
+    Returns:
+        - info, nodes: last iteration completed by the helper, if
+            any, and how many nodes the helper searched.
+    """
+    assert isinstance(_worker_engine, ParallelAlphaBeta)
+    _worker_engine.load_search_options()
+    _worker_engine.root_move_offset = root_move_offset
+    info = None
+    for info in _worker_engine.search_iterations(unpack_board(board), depth):
+        pass
+    return info, _worker_engine.nodes
+
+
+def worker_call(method: str, *args: Any) -> Any:
+    """
+    Calls a method of the worker engine.
+    """
+    assert isinstance(_worker_engine, ParallelAlphaBeta)
+    _worker_engine.load_search_options()
+    return getattr(_worker_engine, method)(*args)
+
+
+def worker_starcall(arguments: Tuple[Any, ...]) -> Any:
+    """
+    Same as `worker_call`, taking the method name and its arguments
+    as a single tuple, e.g. for `Pool.imap_unordered`.
+    """
+    return worker_call(*arguments)
+
+
+class ParallelAlphaBeta(AlphaBeta):
+    """
+    Base class for the parallel engines.
+
+    The engine owns a pool of worker processes that is started once,
+    when the engine is created, and reused by every search. Workers
+    keep their own copy of the engine, sharing the transposition table
+    and the move ordering history with it through shared memory.
+    The pool is shut down by `close`.
+
+    The number of workers, the CPUs they run on and how they're
+    started come from the `threads`, `cpu_affinity` and
+    `start_method` options of the configuration. Search options
+    changed by `configure` are shared with the workers, which
+    apply them before running their next task.
+    """
+
+    def __init__(self, config: Config, processes: Optional[int] = None):
+        """
+        Arguments:
+            - config: engine configuration.
+            - processes: number of worker processes, defaults to
+                the configured number of threads.
+        """
+        super().__init__(config)
+        context = get_context(self.config.start_method)
+        if self.config.cpu_affinity:
+            set_cpu_affinity(self.config.cpu_affinity)
+        # workers read and write the table directly in shared memory
+        self.cache = SharedTranspositionTable(self.config.hash_size)
+        # history is shared, so workers learn from each other's cutoffs
+        self.move_ordering = MoveOrdering(shared=True)
+        # stops the searches running in every worker
+        self.stop_event = context.Event()
+        # alpha bound of the board whose moves are searched in parallel, by ply
+        self.bounds_buffer = SharedBuffer(MAX_PLY * 8)
+        self.bounds = self.bounds_buffer.cast("d")
+        # values of the search options, in the order of SEARCH_OPTIONS
+        self.options_buffer = SharedBuffer(len(SEARCH_OPTIONS) * 4)
+        self.search_options = self.options_buffer.cast("i")
+        self.share_search_options()
+        if processes is None:
+            processes = self.worker_processes(self.config.threads or cpu_count())
+        self.processes = processes
+        self.pool: Optional[Pool] = None
+        if self.processes > 0:
+            self.pool = context.Pool(
+                processes=self.processes,
+                initializer=init_worker,
+                initargs=(self, context.Value("i", 0)),
+            )
+
+    def worker_processes(self, threads: int) -> int:
+        """
+        Returns how many worker processes are used to search with the given number
+        of threads. By default the engine process only waits for the workers.
+        """
+        return threads
+
+    def __getstate__(self):
+        # the pool stays in the process that created it
+        state = self.__dict__.copy()
+        state.pop("pool", None)
+        state.pop("bounds", None)
+        state.pop("search_options", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.bounds = self.bounds_buffer.cast("d")
+        self.search_options = self.options_buffer.cast("i")
+
+    def configure(self, config: Config):
+        super().configure(config)
+        self.share_search_options()
+
+    def share_search_options(self):
+        """
+        Writes the search options of the engine to shared memory, for the workers.
+        """
+        for index, field in enumerate(SEARCH_OPTIONS):
+            self.search_options[index] = int(getattr(self.config, field))
+
+    def load_search_options(self):
+        """
+        Applies the search options shared by the engine process to the
+        configuration of this worker, they're kept in sync by the engine
+        process, which also clears the shared table when they change.
+        """
+        self.apply_search_options({
+            field: type(getattr(self.config, field))(value)
+            for field, value in zip(SEARCH_OPTIONS, self.search_options)
+        })
+
+    def mate_distance(self, score: float) -> float:
+        """
+        Moves mate scores one ply closer to a draw, so shorter mates are preferred.
+        """
+        if score > self.config.checkmate_threshold:
+            return score - 1
+        if score < -self.config.checkmate_threshold:
+            return score + 1
+        return score
+
+    def search_moves_in_parallel(
+        self, board: Board, moves: List[Move], depth: int, alpha: float, beta: float, ply: int,
+    ) -> Generator[Tuple[Move, float], None, None]:
+        """
+        Searches the moves of a board in the workers, sharing the best score
+        found so far as their alpha bound, and yields their scores as the workers
+        finish them. The workers are stopped when the generator is closed
+        before every move is searched (e.g. on a beta cutoff) or when the
+        search is aborted. The nodes searched by the workers are added to ours.
+
+        Arguments:
+            - board: chess board state.
+            - moves: moves to search.
+            - depth: depth of the board.
+            - alpha: best score found so far for the board.
+            - beta: upper bound of the search window.
+            - ply: distance from the root of the search.
+
+        Returns:
+            - move, score: each move with its score, scores
+                lower than alpha are upper bounds.
+        """
+        assert self.pool is not None
+        self.bounds[ply] = alpha
+        position = pack_board(board)
+        results = self.pool.imap_unordered(
+            worker_starcall,
+            [
+                ("search_move_with_shared_bound", position, pack_move(move), depth, ply, beta)
+                for move in moves
+            ],
+        )
+
+        pending = len(moves)
+        try:
+            while pending:
+                try:
+                    move, score, nodes = results.next(timeout=WAIT_INTERVAL)
+                except TimeoutError:
+                    if self.stopped():
+                        raise SearchAborted()
+                    continue
+                pending -= 1
+                self.nodes += nodes
+                if score is None:
+                    continue
+                if score > self.bounds[ply]:
+                    self.bounds[ply] = score
+                yield move, score
+        finally:
+            if pending:
+                for _, _, nodes in self.stop_workers(lambda: list(results)):
+                    self.nodes += nodes
+
+    def stop_workers(self, wait: Callable[[], T]) -> T:
+        """
+        Stops the searches running in the workers and waits until they're done.
+
+        Arguments:
+            - wait: waits for the results of the workers and returns them.
+
+        Returns:
+            - results: what `wait` returned.
+        """
+        stopped = self.stop_event.is_set()
+        self.stop_event.set()
+        try:
+            return wait()
+        finally:
+            # a stop requested from outside of the search is kept
+            if not stopped:
+                self.stop_event.clear()
+
+    def search_move_with_shared_bound(
+        self, packed_board: PackedBoard, packed_move: int, depth: int, ply: int, beta: float,
+    ) -> Tuple[Move, Optional[float], int]:
+        """
+        Searches a move in a worker with a null window around the shared
+        alpha bound of the board, and re-searches it if it might be better.
+
+        Arguments:
+            - packed_board: packed chess board state, before the move.
+            - packed_move: packed move to search.
+            - depth: depth of the board.
+            - ply: distance of the board from the root of the search.
+            - beta: upper bound of the search window.
+
+        Returns:
+            - move, score, nodes: the move and its score for the side to move
+                in the board, or None if the search was stopped, and how
+                many nodes the worker searched.
+        """
+        self.nodes = 0
+        alpha = self.bounds[ply]
+        board = unpack_board(packed_board)
+        move = unpack_move(packed_move)
+        assert move is not None
+        self.evaluation.reset(board)
+        self.make_move(board, move)
+        try:
+            score = -self.negamax(
+                board, depth - 1, self.config.null_move, self.cache, -alpha - 1, -alpha, ply + 1,
+            )[0]
+            # other workers may have raised the bound in the meantime
+            alpha = max(alpha, self.bounds[ply])
+            if alpha < score < beta:
+                score = -self.negamax(
+                    board, depth - 1, self.config.null_move, self.cache, -beta, -alpha, ply + 1,
+                )[0]
+        except SearchAborted:
+            return move, None, self.nodes
+        return move, self.mate_distance(score), self.nodes
+
+    def close(self):
+        """
+        Stops the worker processes.
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
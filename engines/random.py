@@ -1,24 +1,46 @@
 from random import choice
+from typing import Callable, List, Optional
 
 from chess import Board
 
 from config import Config
+from engines.alpha_beta import SearchInfo
 
 
 class RandomEngine:
 
     def __init__(self, _: Config):
-        ...
+        # there are no iterations to report
+        self.on_iteration: Optional[Callable[[List[SearchInfo]], None]] = None
 
-    def search_move(self, board: Board) -> str:
+    def search_move(
+        self, board: Board, depth: Optional[int] = None, time_limit: Optional[float] = None,
+    ) -> str:
         """
         Returns a random move from the list of legal moves.
 
         Arguments:
             - board: chess board state.
+            - depth: unused.
+            - time_limit: unused.
 
         Returns:
             - move: a random move from the list of legal moves.
         """
         move = choice([move for move in board.legal_moves])
         return move.uci()
+
+    def stop(self):
+        ...
+
+    def clear_stop(self):
+        ...
+
+    def clear(self):
+        ...
+
+    def configure(self, _: Config):
+        ...
+
+    def close(self):
+        ...
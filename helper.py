@@ -1,5 +1,6 @@
 from enum import Enum
 
+from engines.abdada import ABDADA
 from engines.alpha_beta import AlphaBeta
 from engines.l1p_alpha_beta import Layer1ParallelAlphaBeta
 from engines.l2p_alpha_beta import Layer2ParallelAlphaBeta
@@ -15,6 +16,7 @@ class Algorithm(Enum):
     parallel_alpha_beta_layer_1 = "parallel_alpha_beta_layer_1"
     parallel_alpha_beta_layer_2 = "parallel_alpha_beta_layer_2"
     lazy_smp = "lazy_smp"
+    abdada = "abdada"
     random = "random"
 
 
@@ -38,6 +40,8 @@ def get_engine(config: Config):
         return Layer2ParallelAlphaBeta(config)
     elif algorithm is Algorithm.lazy_smp:
         return LazySMP(config)
+    elif algorithm is Algorithm.abdada:
+        return ABDADA(config)
     elif algorithm is Algorithm.random:
         return RandomEngine(config)
     raise Exception("algorithm not supported")
@@ -2,18 +2,49 @@
 import click
 import multiprocessing
 
-from config import Config
-from typing import Optional
+from config import (
+    API_CACHE_SIZE,
+    API_CACHE_TTL,
+    API_MOVETIME,
+    API_QUEUE_SIZE,
+    ASPIRATION_WINDOW,
+    BOOK_PATH,
+    BOOK_SELECTIONS,
+    DELTA_MARGIN,
+    FUTILITY_MARGIN,
+    HASH_SIZE,
+    LMR_MIN_DEPTH,
+    LMR_MIN_MOVES,
+    LMR_REDUCTION,
+    REVERSE_FUTILITY_MARGIN,
+    START_METHODS,
+    SYZYGY_CACHE_SIZE,
+    Config,
+)
+from typing import List, Optional
 
 from mode.uci import main as uci_main
 from mode.api import main as api_main
 
 
+def parse_cpu_list(_context, _parameter, value: Optional[str]) -> Optional[List[int]]:
+    """
+    Parses a list of CPUs such as "0-3,6" into [0, 1, 2, 3, 6].
+    """
+    if not value:
+        return None
+    cpus: List[int] = []
+    for part in value.split(","):
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
 def run(config: Config):
     if config.mode == "uci":
         uci_main(config)
     elif config.mode == "api":
-        api_main()
+        api_main(config)
     else:
         raise ValueError("mode not supported, type --help to see supported modes.")
 
@@ -65,9 +96,186 @@ def run(config: Config):
 @click.option(
     "--syzygy-pieces",
     type=int,
-    help="Remaining pieces to use syzygy endgame tablebases.",
+    help="Remaining pieces (including kings) to use syzygy endgame tablebases.",
     default=5
 )
+@click.option(
+    "--syzygy-cache-size",
+    type=int,
+    help="Number of syzygy probe results kept in memory.",
+    default=SYZYGY_CACHE_SIZE
+)
+@click.option(
+    "--hash",
+    "hash_size",
+    type=int,
+    help="Size of the transposition table in MB.",
+    default=HASH_SIZE
+)
+@click.option(
+    "--pvs",
+    type=bool,
+    help="If True, use principal variation search.",
+    default=False,
+)
+@click.option(
+    "--aspiration",
+    type=bool,
+    help="If True, use aspiration windows at the root of iterative deepening.",
+    default=False,
+)
+@click.option(
+    "--aspiration-window",
+    type=float,
+    help="Initial half-width of the aspiration window.",
+    default=ASPIRATION_WINDOW,
+)
+@click.option(
+    "--see-pruning",
+    type=bool,
+    help="If True, skip losing captures (by static exchange evaluation) in quiescence search.",
+    default=False,
+)
+@click.option(
+    "--delta-pruning",
+    type=bool,
+    help="If True, use delta pruning in quiescence search.",
+    default=False,
+)
+@click.option(
+    "--delta-margin",
+    type=int,
+    help="Safety margin for delta pruning.",
+    default=DELTA_MARGIN,
+)
+@click.option(
+    "--lmr",
+    type=bool,
+    help="If True, use late move reductions.",
+    default=False,
+)
+@click.option(
+    "--lmr-min-depth",
+    type=int,
+    help="Minimum remaining depth to reduce late moves.",
+    default=LMR_MIN_DEPTH,
+)
+@click.option(
+    "--lmr-min-moves",
+    type=int,
+    help="Number of moves searched at full depth before reducing.",
+    default=LMR_MIN_MOVES,
+)
+@click.option(
+    "--lmr-reduction",
+    type=int,
+    help="Depth reduction for late moves.",
+    default=LMR_REDUCTION,
+)
+@click.option(
+    "--futility",
+    type=bool,
+    help="If True, use futility pruning at frontier nodes.",
+    default=False,
+)
+@click.option(
+    "--futility-margin",
+    type=int,
+    help="Futility pruning margin per ply of remaining depth.",
+    default=FUTILITY_MARGIN,
+)
+@click.option(
+    "--reverse-futility",
+    type=bool,
+    help="If True, use reverse futility pruning.",
+    default=False,
+)
+@click.option(
+    "--reverse-futility-margin",
+    type=int,
+    help="Reverse futility pruning margin per ply of remaining depth.",
+    default=REVERSE_FUTILITY_MARGIN,
+)
+@click.option(
+    "--threads",
+    type=int,
+    help="Number of search processes used by parallel algorithms, defaults to the number of CPUs.",
+    default=None,
+)
+@click.option(
+    "--cpu-affinity",
+    type=str,
+    callback=parse_cpu_list,
+    help="CPUs to run the engine on, e.g. 0-3,6. Each worker process is pinned to one of them.",
+    default=None,
+)
+@click.option(
+    "--start-method",
+    type=click.Choice(START_METHODS),
+    help="Start method of the worker processes of parallel algorithms.",
+    default=None,
+)
+@click.option(
+    "--multi-pv",
+    type=int,
+    help="Number of best lines searched and reported in UCI mode.",
+    default=1,
+)
+@click.option(
+    "--book",
+    "book_path",
+    type=str,
+    help="Polyglot opening book file, an empty value disables the book.",
+    default=BOOK_PATH,
+)
+@click.option(
+    "--book-in-memory",
+    type=bool,
+    help="If True, load the opening book in memory instead of memory mapping it.",
+    default=False,
+)
+@click.option(
+    "--book-selection",
+    type=click.Choice(BOOK_SELECTIONS),
+    help="How book moves are chosen: the best one or at random by weight.",
+    default="best",
+)
+@click.option(
+    "--book-depth",
+    type=int,
+    help="Maximum number of plies of the game played from the opening book.",
+    default=None,
+)
+@click.option(
+    "--api-workers",
+    type=int,
+    help="Number of search worker processes in API mode, defaults to the number of CPUs.",
+    default=None,
+)
+@click.option(
+    "--api-queue-size",
+    type=int,
+    help="Searches waiting for a free worker in API mode, requests are rejected when it's full.",
+    default=API_QUEUE_SIZE,
+)
+@click.option(
+    "--api-movetime",
+    type=int,
+    help="Default and maximum search time of an API request, in milliseconds.",
+    default=API_MOVETIME,
+)
+@click.option(
+    "--api-cache-size",
+    type=int,
+    help="Number of fixed depth search results kept in API mode.",
+    default=API_CACHE_SIZE,
+)
+@click.option(
+    "--api-cache-ttl",
+    type=float,
+    help="Seconds a search result is kept in API mode.",
+    default=API_CACHE_TTL,
+)
 def main(
     mode: str,
     algorithm: str,
@@ -77,6 +285,35 @@ def main(
     quiescence_search_depth: int,
     syzygy_path: Optional[str],
     syzygy_pieces: int,
+    syzygy_cache_size: int,
+    hash_size: int,
+    pvs: bool,
+    aspiration: bool,
+    aspiration_window: float,
+    see_pruning: bool,
+    delta_pruning: bool,
+    delta_margin: int,
+    lmr: bool,
+    lmr_min_depth: int,
+    lmr_min_moves: int,
+    lmr_reduction: int,
+    futility: bool,
+    futility_margin: int,
+    reverse_futility: bool,
+    reverse_futility_margin: int,
+    threads: Optional[int],
+    cpu_affinity: Optional[List[int]],
+    start_method: Optional[str],
+    multi_pv: int,
+    book_path: str,
+    book_in_memory: bool,
+    book_selection: str,
+    book_depth: Optional[int],
+    api_workers: Optional[int],
+    api_queue_size: int,
+    api_movetime: int,
+    api_cache_size: int,
+    api_cache_ttl: float,
 ):
     """
     Starts the engine according to the options provided.
@@ -90,6 +327,35 @@ def main(
         quiescence_search_depth=quiescence_search_depth,
         syzygy_path=syzygy_path,
         syzygy_pieces=syzygy_pieces,
+        syzygy_cache_size=syzygy_cache_size,
+        hash_size=hash_size,
+        pvs=pvs,
+        aspiration=aspiration,
+        aspiration_window=aspiration_window,
+        see_pruning=see_pruning,
+        delta_pruning=delta_pruning,
+        delta_margin=delta_margin,
+        lmr=lmr,
+        lmr_min_depth=lmr_min_depth,
+        lmr_min_moves=lmr_min_moves,
+        lmr_reduction=lmr_reduction,
+        futility=futility,
+        futility_margin=futility_margin,
+        reverse_futility=reverse_futility,
+        reverse_futility_margin=reverse_futility_margin,
+        threads=threads,
+        cpu_affinity=cpu_affinity,
+        start_method=start_method,
+        multi_pv=multi_pv,
+        book_path=book_path or None,
+        book_in_memory=book_in_memory,
+        book_selection=book_selection,
+        book_depth=book_depth,
+        api_workers=api_workers,
+        api_queue_size=api_queue_size,
+        api_movetime=api_movetime,
+        api_cache_size=api_cache_size,
+        api_cache_ttl=api_cache_ttl,
     )
     run(config)
 
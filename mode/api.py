@@ -1,34 +1,55 @@
 import ast
-from multiprocessing import set_start_method
-from typing import Any, Dict
+import json
+import queue
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, TimeoutError, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import replace
+from typing import Any, Deque, Dict, Iterator, List, Mapping, Optional, Tuple
 
-from chess import Board, polyglot
-from flask import Flask, request
+from chess import Board
+from flask import Flask, Response, request
+
+from book import book_move
 from config import Config
 from flask_cors import CORS, cross_origin
 
-from helper import get_engine
+from helper import Algorithm
+from engines.alpha_beta import SearchInfo, mate_in
+from search_service import QueueFull, SearchFailed, SearchResult, SearchService
+
+# Extra time (in seconds) we wait for a search after its deadline,
+# so it can stop and send back the best move it found.
+DEADLINE_GRACE = 1.0
+# How often (in seconds) a search stream sends a comment while there's no
+# progress, so we notice when the client disconnects.
+KEEPALIVE_INTERVAL = 1.0
 
 app = Flask(__name__)
 cors = CORS(app)
 app.config["CORS_HEADER"] = "Content-Type"
 
 
-def format_response(best_move: str) -> Dict[str, Any]:
+def format_response(
+    best_move: Optional[str], status_code: int = 200, error: Optional[str] = None,
+) -> Dict[str, Any]:
     """
     Format the response to be sent back to the client.
 
     Arguments:
             - best_move: the best move found.
+            - status_code: HTTP status code of the response.
+            - error: why the request failed, if it did.
 
     Returns:
             - response: a dictionary containing the best
-                    move and headers (status code, and allowing
-                    CORS) to be sent back to the client.
+                    move (or the error) and headers (status code,
+                    and allowing CORS) to be sent back to the client.
     """
     return {
-        "statusCode": 200,
-        "body": {"move": best_move},
+        "statusCode": status_code,
+        "body": {"move": best_move} if error is None else {"error": error},
         "headers": {
             "Access-Control-Allow-Headers": "Content-Type",
             "Access-Control-Allow-Origin": "*",
@@ -37,9 +58,73 @@ def format_response(best_move: str) -> Dict[str, Any]:
     }
 
 
+def format_error(error: str, status_code: int) -> Tuple[Dict[str, Any], int, Dict[str, str]]:
+    """
+    Format an error response, clients are asked to retry later when
+    the server is overloaded (429) or the search failed (503).
+    """
+    headers = {"Retry-After": "1"} if status_code in (429, 503) else {}
+    return format_response(None, status_code, error), status_code, headers
+
+
+def search_options(server_config: Config, args: Mapping[str, Any]) -> Tuple[Config, Optional[int], int]:
+    """
+    Reads the search options of a request.
+
+    Arguments:
+            - server_config: configuration the server was started with,
+                    request options override its search options.
+            - args: request options, e.g. the query string.
+
+    Returns:
+            - config, depth, movetime: engine configuration, maximum depth
+                    (None to search until the deadline) and search time
+                    in milliseconds.
+
+    Raises:
+            - ValueError: if an option is invalid.
+    """
+    algorithm = args.get("algorithm", "alpha_beta")
+    if algorithm not in Algorithm.__members__:
+        raise ValueError(f"unknown algorithm {algorithm}")
+
+    # without depth, a request with a movetime searches until its deadline
+    depth: Optional[int] = int(args.get("depth", 4))
+    if "depth" not in args and "movetime" in args:
+        depth = None
+    # every search has a deadline, so the latency of a request is bounded
+    movetime = min(int(args.get("movetime", server_config.api_movetime)), server_config.api_movetime)
+
+    config = replace(
+        server_config,
+        mode="api",
+        algorithm=algorithm,
+        negamax_depth=depth or server_config.negamax_depth,
+        null_move=bool(ast.literal_eval(str(args.get("null_move", "False")))),
+        null_move_r=int(args.get("null_move_r", 2)),
+        quiescence_search_depth=int(args.get("quiescence_search_depth", 3)),
+    )
+    return config, depth, max(movetime, 0)
+
+
+def request_search(server_config: Config) -> Tuple[Config, Board, Optional[int], int]:
+    """
+    Reads the search parameters of the request, see `search_options`.
+
+    Returns:
+            - config, board, depth, movetime: engine configuration, board
+                    to search, maximum depth and search time in milliseconds.
+    """
+    fen = request.args.get("fen")
+    if fen is None:
+        raise ValueError("missing fen")
+    config, depth, movetime = search_options(server_config, request.args)
+    return config, Board(fen), depth, movetime
+
+
 @app.route("/")
 @cross_origin()
-def main_search() -> Dict[str, Any]:
+def main_search() -> Any:
     """
     Main search route. We'll first search on our opening
     book and if we can't find the move, we'll search using
@@ -49,58 +134,297 @@ def main_search() -> Dict[str, Any]:
     request to this route with the following parameters:
             - fen: the fen of the board.
             - depth: the depth to search.
+            - movetime: maximum search time in milliseconds, once it
+                    expires we get the best move found so far.
             - null_move: if we're using null move pruning.
                     Options: True, False.
             - algorithm: the algorithm to use. Can be one of
                     the enumerations in the Algorithm class in
                     helper.py.
 
+    Searches run in a fixed pool of worker processes. When too many
+    searches are waiting for a worker the request is rejected (429).
+
     Returns:
             - response: a dictionary containing the best
                     move and headers (status code, and allowing
                     CORS) to be sent back to the client.
     """
-    # get the parameters from the request
-    fen = request.args.get("fen")
-    depth = int(request.args.get("depth", 4))
-    quiescence_search_depth = int(request.args.get("quiescence_search_depth", 3))
-    null_move = ast.literal_eval(str(request.args.get("null_move")))
-    null_move_r = int(request.args.get("null_move_r", 2))
-    algorithm = request.args.get("algorithm", "alpha_beta")
-
-    config = Config(
-        mode="api",
-        algorithm=algorithm,
-        negamax_depth=depth,
-        null_move=null_move,
-        null_move_r=null_move_r,
-        quiescence_search_depth=quiescence_search_depth
-    )
+    server_config: Config = app.config["ENGINE_CONFIG"]
+    service: SearchService = app.config["SEARCH_SERVICE"]
 
-    # create the board
-    board = Board(fen)
+    # get the parameters from the request
+    try:
+        config, board, depth, movetime = request_search(server_config)
+    except (ValueError, SyntaxError) as error:
+        return format_error(str(error), 400)
+    deadline = time.time() + movetime / 1000
 
     # try using cerebellum opening book: https://zipproth.de/Brainfish/download/
-    # if it fails we search on our engine. The first (12-20) moves should be
+    # if the board isn't there we search on our engine. The first (12-20) moves should be
     # available in the opening book, so our engine starts playing after that.
+    move = book_move(board, config)
+    if move is not None:
+        return format_response(move.uci())
+
+    try:
+        search = service.search(config, board.fen(), depth, deadline)
+    except QueueFull:
+        return format_error("too many searches, try again later", 429)
+
     try:
-        best_move = (
-            polyglot.MemoryMappedReader("opening_book/cerebellum.bin")
-            .find(board)
-            .move
-            .uci()
-        )
-    except:
-        engine = get_engine(config)
-        best_move = engine.search_move(board).uci()
+        result = search.result(timeout=max(deadline - time.time(), 0) + DEADLINE_GRACE)
+    except TimeoutError:
+        # the search isn't cancelled, identical requests may be waiting for it,
+        # and it won't take long as it stops at its deadline
+        return format_error("search didn't finish in time", 503)
+    except BrokenProcessPool:
+        return format_error("search failed", 503)
 
-    return format_response(best_move)
+    return format_response(result.move)
 
 
-def main():
+def request_boards() -> List[Board]:
+    """
+    Reads the positions of a batch request: a JSON object with a list
+    of FENs (`{"fens": [...]}`), or an EPD body with one position per line.
+
+    Raises:
+            - ValueError: if a position is invalid.
+    """
+    if request.is_json:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get("fens"), list):
+            raise ValueError("expected a list of fens")
+        return [Board(fen) for fen in body["fens"]]
+    boards = []
+    for line in request.get_data(as_text=True).splitlines():
+        if not line.strip():
+            continue
+        try:
+            # FENs are valid EPDs, but their move counters would be read as operations
+            boards.append(Board(line))
+        except ValueError:
+            boards.append(Board.from_epd(line)[0])
+    return boards
+
+
+def format_score(score: float, config: Config) -> Dict[str, int]:
+    """
+    Formats a score for the side to move, e.g. {"score": 35} or {"mate": -2}.
+    """
+    mate = mate_in(score, config)
+    if mate is not None:
+        return {"mate": mate}
+    return {"score": int(score)}
+
+
+def result_line(index: int, board: Board, search: Future, config: Config) -> Dict[str, Any]:
+    """
+    Formats the result of a position of a batch request.
+    """
+    line: Dict[str, Any] = {"index": index, "fen": board.fen()}
+    try:
+        result: SearchResult = search.result()
+    except BrokenProcessPool:
+        line["error"] = "search failed"
+        return line
+
+    line.update(move=result.move, depth=result.depth, nodes=result.nodes, time=round(result.time, 3))
+    if result.score is not None:
+        line.update(format_score(result.score, config))
+    return line
+
+
+def batch_results(
+    service: SearchService, config: Config, boards: List[Board], depth: Optional[int], movetime: int,
+) -> Iterator[str]:
+    """
+    Searches the positions of a batch, and yields the result of each one
+    as a NDJSON line as soon as it's searched, in the order they finish.
+
+    The batch keeps at most one position per worker in the queue, so other
+    requests aren't stuck behind it, and each position gets its own deadline
+    when it's sent to the workers. Positions are no longer sent once the
+    client disconnects.
+    """
+    queued: Deque[Tuple[int, Board]] = deque(enumerate(boards))
+    running: List[Tuple[Future, int, Board]] = []
+    while queued or running:
+        while queued and len(running) < service.workers:
+            index, board = queued[0]
+            try:
+                search = service.search(config, board.fen(), depth, time.time() + movetime / 1000)
+            except QueueFull:
+                if running:
+                    break
+                # the queue is full of searches of other requests
+                queued.popleft()
+                yield json.dumps({"index": index, "fen": board.fen(), "error": "too many searches"}) + "\n"
+                continue
+            queued.popleft()
+            running.append((search, index, board))
+
+        if not running:
+            continue
+        wait([search for search, _, _ in running], return_when=FIRST_COMPLETED)
+        finished = [task for task in running if task[0].done()]
+        running = [task for task in running if task not in finished]
+        for search, index, board in finished:
+            yield json.dumps(result_line(index, board, search, config)) + "\n"
+
+
+@app.route("/batch", methods=["POST"])
+@cross_origin()
+def batch_search() -> Any:
+    """
+    Batch search route, e.g. to analyse every position of a game.
+
+    The client will POST the positions, as a JSON object with a list
+    of FENs (`{"fens": [...], "depth": 4}`) or as an EPD body with one
+    position per line. Search options (depth, movetime, algorithm...)
+    are the same as the main route, they're read from the JSON object
+    or from the query string.
+
+    Positions are searched by the engine (the opening book isn't used,
+    so every position gets a score), and each result is streamed as
+    a NDJSON line as soon as it's ready, in the order they finish:
+    index of the position, fen, move, score (or mate), depth, nodes and time.
+    """
+    server_config: Config = app.config["ENGINE_CONFIG"]
+    service: SearchService = app.config["SEARCH_SERVICE"]
+
+    try:
+        boards = request_boards()
+        body = request.get_json(silent=True) if request.is_json else None
+        config, depth, movetime = search_options(server_config, body if body is not None else request.args)
+    except (ValueError, SyntaxError) as error:
+        return format_error(str(error), 400)
+
+    return Response(batch_results(service, config, boards, depth, movetime), mimetype="application/x-ndjson")
+
+
+def format_event(event: str, data: Dict[str, Any]) -> str:
+    """
+    Formats a server-sent event.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def info_event(info: SearchInfo, config: Config) -> str:
+    """
+    Formats the progress of a search (one completed iteration) as a server-sent event.
+    """
+    return format_event("info", {
+        "depth": info.depth,
+        **format_score(info.score, config),
+        "pv": [move.uci() for move in info.pv],
+        "nodes": info.nodes,
+        "nps": int(info.nodes / info.time) if info.time > 0 else 0,
+        "time": round(info.time, 3),
+    })
+
+
+def search_events(search: Future, updates: Any, cancel: Any, config: Config) -> Iterator[str]:
+    """
+    Yields the progress of a streamed search as server-sent events, as the
+    worker sends it: one info event per completed iteration, then the best
+    move, or an error event if the search failed. The search is stopped
+    when the stream is closed, e.g. when the client disconnects before
+    the search is done.
+    """
+    try:
+        while True:
+            try:
+                update = updates.get(timeout=KEEPALIVE_INTERVAL)
+            except queue.Empty:
+                if search.done() and search.exception() is not None:
+                    yield format_event("error", {"error": "search failed"})
+                    return
+                # comments are ignored by clients, but fail once they're gone
+                yield ": keepalive\n\n"
+                continue
+            if isinstance(update, SearchInfo):
+                yield info_event(update, config)
+            elif isinstance(update, SearchFailed):
+                yield format_event("error", {"error": "search failed"})
+                return
+            elif update is None:
+                return
+            else:
+                yield format_event("bestmove", {"move": update})
+    finally:
+        cancel.set()
+
+
+@app.route("/stream")
+@cross_origin()
+def stream_search() -> Any:
+    """
+    Streaming search route, e.g. for an analysis board showing
+    the search progress.
+
+    The client sends the same parameters as the main route, and gets
+    server-sent events (text/event-stream): an `info` event for each
+    completed iteration (depth, score or mate, pv, nodes, nps and time)
+    and a `bestmove` event once the search is done (an `error` event if it
+    failed). Engines that don't search with iterative deepening (the layer
+    1 and layer 2 parallel searches) send a single `info` event, when their
+    search completes. The search is stopped when the client disconnects.
+    """
+    server_config: Config = app.config["ENGINE_CONFIG"]
+    service: SearchService = app.config["SEARCH_SERVICE"]
+
+    try:
+        config, board, depth, movetime = request_search(server_config)
+    except (ValueError, SyntaxError) as error:
+        return format_error(str(error), 400)
+
+    try:
+        search, updates, cancel = service.stream(config, board.fen(), depth, time.time() + movetime / 1000)
+    except QueueFull:
+        return format_error("too many searches, try again later", 429)
+
+    return Response(
+        search_events(search, updates, cancel, config),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/stats")
+@cross_origin()
+def search_stats() -> Dict[str, Any]:
+    """
+    Statistics of the search service: result cache hits and misses,
+    requests that waited for an identical search, and pending searches.
+    """
+    service: SearchService = app.config["SEARCH_SERVICE"]
+    return service.stats()
+
+
+def setup(config: Config) -> Flask:
+    """
+    Starts the search workers and returns the application,
+    e.g. to serve it with a WSGI server (see the README).
+    It's called once per server process, each call starts
+    its own search workers and result cache.
+    """
+    app.config["ENGINE_CONFIG"] = config
+    app.config["SEARCH_SERVICE"] = SearchService(config)
+    return app
+
+
+def main(config: Config):
     """
     Main function to start listening engine.
     """
-    # start listening on local host
-    app.run(host="0.0.0.0", port=5000, debug=True)
-    set_start_method("chess")
+    setup(config)
+    try:
+        # start listening on local host with Flask's development server, each
+        # request is handled in its own thread while waiting for its search
+        # to run in the worker processes. In production, serve the application
+        # returned by `setup` with a WSGI server instead.
+        app.run(host="0.0.0.0", port=5000, threaded=True)
+    finally:
+        app.config["SEARCH_SERVICE"].close()
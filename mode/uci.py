@@ -1,12 +1,340 @@
 import sys
+import threading
+from multiprocessing import cpu_count
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
 
-from chess import STARTING_FEN, Board, polyglot
+from chess import STARTING_FEN, Board, Move
 
+from book import book_move
 from helper import get_engine
 from config import Config
+from engines.alpha_beta import MAX_DEPTH, SearchInfo, mate_in
+from engines.base_engine import ChessEngine
+from time_management import time_budget
 
 # UCI based on Sunfish Engine: https://github.com/thomasahle/sunfish/blob/master/uci.py
 
+# numeric arguments of the go command
+GO_ARGUMENTS = ("wtime", "btime", "winc", "binc", "movestogo", "movetime", "depth")
+
+
+class UCIOption(NamedTuple):
+    """
+    Option advertised to the GUI, setting a field of the configuration.
+    """
+    name: str
+    field: str
+    type: str
+    minimum: int = 0
+    maximum: int = 0
+
+
+# options that can be changed with the setoption command
+UCI_OPTIONS = (
+    UCIOption("Hash", "hash_size", "spin", 1, 65536),
+    UCIOption("Threads", "threads", "spin", 1, 1024),
+    UCIOption("SyzygyPath", "syzygy_path", "string"),
+    UCIOption("SyzygyProbeLimit", "syzygy_pieces", "spin", 0, 7),
+    UCIOption("MultiPV", "multi_pv", "spin", 1, 256),
+    UCIOption("NullMove", "null_move", "check"),
+    UCIOption("NullMoveR", "null_move_r", "spin", 1, 10),
+    UCIOption("QuiescenceSearchDepth", "quiescence_search_depth", "spin", 0, 64),
+)
+
+
+def parse_go(uci_parameters: List[str]) -> Dict[str, int]:
+    """
+    Parses the numeric arguments of the UCI go command,
+    e.g. `go wtime 1000 btime 1000 winc 10 binc 10`.
+
+    Arguments:
+        - uci_parameters: the go command split by spaces.
+
+    Returns:
+        - arguments: dictionary from argument name to its value.
+    """
+    arguments = {}
+    for name, value in zip(uci_parameters, uci_parameters[1:]):
+        if name in GO_ARGUMENTS:
+            arguments[name] = int(value)
+    return arguments
+
+
+def parse_setoption(uci_command: str) -> Tuple[str, Optional[str]]:
+    """
+    Parses the UCI setoption command, e.g. `setoption name Threads value 4`.
+
+    Arguments:
+        - uci_command: the setoption command.
+
+    Returns:
+        - name, value: name of the option and its value, if any.
+    """
+    _, _, option = uci_command.partition(" name ")
+    name, _, value = option.partition(" value ")
+    return name.strip(), value.strip() or None
+
+
+def update_position(
+    board: Board, board_fen: str, board_moves: List[str], fen: str, moves: List[str],
+) -> Board:
+    """
+    Sets up the position of a position command. GUIs send the whole game
+    with every command, so when it starts from the same FEN as the current
+    board we only take back and play the moves that differ, instead of
+    replaying the whole game on a new board.
+
+    Arguments:
+        - board: current board, it's modified in place when it can be reused.
+        - board_fen: FEN the current board started from.
+        - board_moves: UCI moves played on the current board, they're updated in place.
+        - fen: FEN of the position command.
+        - moves: UCI moves of the position command.
+
+    Returns:
+        - board: board of the position command.
+    """
+    if fen != board_fen:
+        board = Board(fen)
+        board_moves.clear()
+
+    # moves both games have in common
+    common = 0
+    for played, move in zip(board_moves, moves):
+        if played != move:
+            break
+        common += 1
+
+    for _ in range(len(board_moves) - common):
+        board.pop()
+    del board_moves[common:]
+    for move in moves[common:]:
+        board.push_uci(move)
+        board_moves.append(move)
+    return board
+
+
+def option_command(option: UCIOption, config: Config) -> str:
+    """
+    Formats the option command advertising an option, with
+    its current value in the configuration as the default.
+    """
+    value = getattr(config, option.field)
+    if option.type == "spin":
+        if value is None:
+            # threads default to the number of CPUs
+            value = cpu_count()
+        return (
+            f"option name {option.name} type spin default {value} "
+            f"min {option.minimum} max {option.maximum}"
+        )
+    if option.type == "check":
+        return f"option name {option.name} type check default {str(bool(value)).lower()}"
+    return f"option name {option.name} type string default {value or '<empty>'}"
+
+
+def set_option(config: Config, name: str, value: Optional[str]) -> bool:
+    """
+    Applies the value of an option (from the setoption command) to the configuration.
+
+    Arguments:
+        - config: engine configuration, it's modified in place.
+        - name: name of the option, case insensitive.
+        - value: value of the option, if any.
+
+    Returns:
+        - applied: False if we don't know the option or the value is invalid.
+    """
+    option = next((option for option in UCI_OPTIONS if option.name.lower() == name.lower()), None)
+    if option is None:
+        return False
+
+    if option.type == "spin":
+        try:
+            number = int(value or "")
+        except ValueError:
+            return False
+        setattr(config, option.field, min(max(number, option.minimum), option.maximum))
+    elif option.type == "check":
+        setattr(config, option.field, (value or "").lower() == "true")
+    else:
+        setattr(config, option.field, None if value in (None, "<empty>") else value)
+    return True
+
+
+def score_command(score: float, config: Config) -> str:
+    """
+    Formats a score for the info command, e.g. `cp 35` or `mate -2`.
+    """
+    mate = mate_in(score, config)
+    if mate is not None:
+        return f"mate {mate}"
+    return f"cp {int(score)}"
+
+
+def info_command(info: SearchInfo, config: Config, line: int) -> str:
+    """
+    Formats the info command of a searched line (MultiPV).
+    """
+    return (
+        f"info multipv {line} depth {info.depth} score {score_command(info.score, config)} "
+        f"nodes {info.nodes} time {int(info.time * 1000)} pv {' '.join(move.uci() for move in info.pv)}"
+    )
+
+
+def bestmove_command(engine: ChessEngine, board: Board, best_move: Union[Move, str, None]) -> str:
+    """
+    Formats the bestmove command, with the reply we expect from the
+    opponent (from the transposition table) as the move to ponder on.
+
+    Arguments:
+        - engine: engine that searched the board.
+        - board: board that was searched.
+        - best_move: best move found, if None we play the first legal move.
+
+    Returns:
+        - command: the bestmove command, e.g. `bestmove e2e4 ponder e7e5`.
+    """
+    if best_move is None:
+        best_move = next(iter(board.legal_moves))
+    move = Move.from_uci(str(best_move))
+    command = f"bestmove {move.uci()}"
+
+    cache = getattr(engine, "cache", None)
+    if cache is not None:
+        board = board.copy(stack=False)
+        board.push(move)
+        entry = cache.probe(cache.key(board))
+        if entry is not None and entry.move is not None and board.is_legal(entry.move):
+            command += f" ponder {entry.move.uci()}"
+    return command
+
+
+class SearchThread(threading.Thread):
+    """
+    Runs a search in the background, so we keep answering UCI
+    commands (isready, stop, ponderhit, quit) while the engine thinks.
+
+    Infinite and ponder searches only send their best move
+    once they're stopped, even if the search ends before that.
+    """
+
+    def __init__(
+        self,
+        engine: ChessEngine,
+        board: Board,
+        depth: Optional[int],
+        time_limit: Optional[float],
+        infinite: bool = False,
+        config: Optional[Config] = None,
+    ):
+        """
+        Arguments:
+            - engine: engine used to search.
+            - board: board to search, it's not modified.
+            - depth: maximum depth to search.
+            - time_limit: how many seconds we can search for.
+            - infinite: if the best move is only sent after the search is stopped.
+            - config: engine configuration, when it's given the lines found
+                by each iteration (as many as MultiPV) are sent as info commands.
+        """
+        super().__init__(daemon=True)
+        self.engine = engine
+        self.board = board.copy()
+        self.depth = depth
+        self.time_limit = time_limit
+        self.infinite = infinite
+        self.config = config
+        # set when the best move can be sent
+        self.released = threading.Event()
+        if not infinite:
+            self.released.set()
+        self.silent = False
+
+    def run(self):
+        if self.config is not None:
+            self.engine.on_iteration = self.send_lines
+        try:
+            best_move = self.engine.search_move(self.board.copy(), self.depth, self.time_limit)
+        except Exception as error:
+            # the GUI waits for a best move, even if the search failed
+            print(f"info string search failed: {error!r}", flush=True)
+            best_move = next(iter(self.board.legal_moves), None)
+        finally:
+            self.engine.on_iteration = None
+        self.released.wait()
+        if not self.silent:
+            print(bestmove_command(self.engine, self.board, best_move), flush=True)
+
+    def send_lines(self, infos: List[SearchInfo]):
+        """
+        Sends the lines found by an iteration of the search, best line first.
+        """
+        assert self.config is not None
+        for line, info in enumerate(infos, start=1):
+            print(info_command(info, self.config, line), flush=True)
+
+    def stop(self, silent: bool = False):
+        """
+        Stops the search and waits until it's done.
+
+        Arguments:
+            - silent: if True, the best move isn't sent (e.g. on ponderhit).
+        """
+        self.silent = silent
+        self.engine.stop()
+        self.released.set()
+        self.join()
+
+    def finish(self):
+        """
+        Waits for the search to finish, stopping it if it would never do so.
+        """
+        if self.infinite:
+            self.stop()
+        else:
+            self.join()
+
+
+def start_search(
+    engine: ChessEngine,
+    board: Board,
+    go_arguments: Dict[str, int],
+    infinite: bool = False,
+    config: Optional[Config] = None,
+) -> SearchThread:
+    """
+    Starts searching the board in the background.
+
+    Arguments:
+        - engine: engine used to search.
+        - board: board to search.
+        - go_arguments: numeric arguments of the go command.
+        - infinite: if we search until we're stopped (go infinite and go ponder).
+        - config: engine configuration, used for MultiPV.
+
+    Returns:
+        - search: the thread running the search.
+    """
+    depth = go_arguments.get("depth")
+    time_limit = None
+    if infinite:
+        depth = depth or MAX_DEPTH
+    else:
+        time_limit = time_budget(
+            board.turn,
+            wtime=go_arguments.get("wtime"),
+            btime=go_arguments.get("btime"),
+            winc=go_arguments.get("winc"),
+            binc=go_arguments.get("binc"),
+            movestogo=go_arguments.get("movestogo"),
+            movetime=go_arguments.get("movetime"),
+        )
+    engine.clear_stop()
+    search = SearchThread(engine, board, depth, time_limit, infinite, config)
+    search.start()
+    return search
+
 
 def main(config: Config):
     """
@@ -14,7 +342,16 @@ def main(config: Config):
     """
     # init board and engine
     board = Board()
+    # FEN and moves of the last position command, so the next one only plays the new moves
+    board_fen = STARTING_FEN
+    board_moves: List[str] = []
     engine = get_engine(config)
+    # search running in the background, if any
+    search: Optional[SearchThread] = None
+    # arguments of the go ponder command, used once the opponent plays the expected move
+    ponder_arguments: Optional[Dict[str, int]] = None
+    # set when an option changed, the engine is created again before the next search
+    engine_outdated = False
 
     # keep listening to UCI commands
     while True:
@@ -23,23 +360,63 @@ def main(config: Config):
         uci_parameters = uci_command.split(" ")
 
         if uci_command == "quit":
+            if search is not None:
+                search.stop(silent=True)
+            engine.close()
             sys.exit()
 
         elif uci_command == "uci":
             # engine details
             print("id name Moonfish")
             print("id author luccabb")
-            print("uciok")
+            for option in UCI_OPTIONS:
+                print(option_command(option, config))
+            print("option name Ponder type check default false")
+            print("uciok", flush=True)
 
         elif uci_command == "isready":
+            if engine_outdated and (search is None or not search.is_alive()):
+                # the GUI waits for readyok, so it's a good time to start the workers
+                engine.close()
+                engine = get_engine(config)
+                engine_outdated = False
             # engine ready to receive commands
-            print("readyok")
+            print("readyok", flush=True)
+
+        elif uci_command == "stop":
+            if search is not None:
+                search.stop()
+            search, ponder_arguments = None, None
+
+        elif uci_command == "ponderhit":
+            if search is not None and ponder_arguments is not None:
+                # the opponent played the move we pondered on, we search it again
+                # with our time, the transposition table filled while pondering is kept
+                search.stop(silent=True)
+                search = start_search(engine, board, ponder_arguments, config=config)
+            ponder_arguments = None
+
+        elif uci_command.startswith("setoption"):
+            if search is not None:
+                search.finish()
+            search = None
+            name, value = parse_setoption(uci_command)
+            # engines (and their workers) keep the configuration they were created with
+            if set_option(config, name, value):
+                engine_outdated = True
 
         elif uci_command == "ucinewgame":
-            # start new game
+            if search is not None:
+                search.finish()
+            # start new game, what was learned in the previous one is
+            # forgotten (it's kept between the moves of the same game)
             board = Board()
+            board_fen, board_moves = STARTING_FEN, []
+            engine.clear()
 
         elif uci_command.startswith("position"):
+            if search is not None:
+                search.finish()
             moves_idx = uci_command.find("moves")
 
             # get moves from UCI command
@@ -55,6 +432,7 @@ def main(config: Config):
                     _, _, fen = fenpart.split(" ", 2)
                 else:
                     fen = " ".join(uci_parameters[2:])
+                fen = fen.strip()
 
             elif uci_parameters[1] == "startpos":
                 fen = STARTING_FEN
@@ -62,22 +440,27 @@ def main(config: Config):
                 raise SyntaxError("UCI Syntax error.")
 
             # start board and make moves
-            board = Board(fen)
-            for move in moveslist:
-                board.push_uci(move)
+            board = update_position(board, board_fen, board_moves, fen, moveslist)
+            board_fen = fen
 
         elif uci_command.startswith("go"):
+            if search is not None:
+                search.finish()
+            if engine_outdated:
+                engine.close()
+                engine = get_engine(config)
+                engine_outdated = False
+            go_arguments = parse_go(uci_parameters)
+            ponder = "ponder" in uci_parameters
+            infinite = ponder or "infinite" in uci_parameters
+            ponder_arguments = go_arguments if ponder else None
 
             # try using cerebellum opening book: https://zipproth.de/Brainfish/download/
-            # if it fails we search on our engine. The first (12-20) moves should be
-            # available in the opening book, so our engine starts playing after that.
-            try:
-                best_move = (
-                    polyglot.MemoryMappedReader("opening_book/cerebellum.bin")
-                    .find(board)
-                    .move
-                    .uci()
-                )
-            except:
-                best_move = engine.search_move(board)
-            print(f"bestmove {best_move}")
+            # if the board isn't there we search on our engine. The first (12-20) moves should
+            # be available in the opening book, so our engine starts playing after that.
+            best_move = None if infinite else book_move(board, config)
+            if best_move is not None:
+                search = None
+                print(f"bestmove {best_move}", flush=True)
+            else:
+                search = start_search(engine, board, go_arguments, infinite, config)
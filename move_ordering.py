@@ -1,35 +1,267 @@
-import random
+from array import array
+from typing import List, MutableSequence, Optional
 
-from chess import BLACK, Board, Move
+from chess import (
+    BB_SQUARES,
+    BISHOP,
+    BLACK,
+    KING,
+    KNIGHT,
+    PAWN,
+    PIECE_TYPES,
+    QUEEN,
+    ROOK,
+    WHITE,
+    Board,
+    Color,
+    Move,
+    lsb,
+)
 
-from psqt import evaluate_capture, evaluate_piece, get_phase
+from psqt import MG_PIECE_VALUES, evaluate_capture, evaluate_piece, get_phase
+from shared_buffer import SharedBuffer
 
 
-def organize_moves(board: Board):
+# Maximum number of plies we keep killer moves for.
+MAX_PLY = 128
+# Number of killer moves kept per ply.
+KILLER_SLOTS = 2
+# History table is indexed by side to move, from square and to square.
+HISTORY_SIZE = 2 * 64 * 64
+# History scores are halved when one of them reaches this value.
+HISTORY_MAX = 1 << 24
+# Piece values used to sort captures by MVV-LVA.
+MVV_LVA_VALUES = {
+    None: 0,
+    PAWN: 1,
+    KNIGHT: 3,
+    BISHOP: 3,
+    ROOK: 5,
+    QUEEN: 9,
+    KING: 100,
+}
+
+
+def history_index(color: Color, move: Move) -> int:
     """
-    This function receives a board and it returns a list of all the
-    possible moves for the current player, sorted by importance.
-    It sends capturing moves at the starting positions in 
-    the array (to try to increase pruning and do so earlier).
+    Returns the index of a move in the history table.
+    """
+    return (color * 64 + move.from_square) * 64 + move.to_square
+
+
+def capture_score(board: Board, move: Move) -> int:
+    """
+    Scores captures and promotions by most valuable victim,
+    least valuable attacker (MVV-LVA).
+
+    Arguments:
+            - board: chess board state
+            - move: capture or promotion move
+
+    Returns:
+            - score: higher scores should be searched first.
+    """
+    victim: Optional[int]
+    if board.is_en_passant(move):
+        victim = PAWN
+    else:
+        victim = board.piece_type_at(move.to_square)
+    attacker = board.piece_type_at(move.from_square)
+
+    score = MVV_LVA_VALUES[victim] * 16 - MVV_LVA_VALUES[attacker]
+    if move.promotion:
+        score += MVV_LVA_VALUES[move.promotion] * 16
+    return score
+
+
+def static_exchange_evaluation(board: Board, move: Move) -> int:
+    """
+    Static Exchange Evaluation (SEE): estimates the material balance of
+    the sequence of captures on the target square of a move, where both
+    sides always recapture with their least valuable attacker and can
+    stop capturing when it's not favorable anymore. Pins are ignored.
 
     Arguments:
             - board: chess board state
+            - move: capture move
 
     Returns:
-            - legal_moves: list of all the possible moves for the current player.
+            - score: material won (positive) or lost (negative) by
+                the side to move after the exchange.
     """
-    non_captures = []
-    captures = []
+    to_square = move.to_square
+    occupied = board.occupied ^ BB_SQUARES[move.from_square]
+
+    victim: Optional[int]
+    if board.is_en_passant(move):
+        victim = PAWN
+        occupied ^= BB_SQUARES[to_square + (-8 if board.turn == WHITE else 8)]
+    else:
+        victim = board.piece_type_at(to_square)
+
+    # gains[i] is the material balance after the i-th capture,
+    # from the point of view of the side that made it
+    gains = [MG_PIECE_VALUES[victim] if victim else 0]
+    on_square = move.promotion or board.piece_type_at(move.from_square)
+    assert on_square is not None
+    color = not board.turn
+
+    while True:
+        # attackers are computed with the current occupancy, so
+        # sliding pieces behind the ones that captured (x-rays) are included
+        attackers = board._attackers_mask(color, to_square, occupied) & occupied
+        if not attackers:
+            break
+
+        # find least valuable attacker
+        for piece_type in PIECE_TYPES:
+            piece_attackers = attackers & board.pieces_mask(piece_type, color)
+            if piece_attackers:
+                break
 
-    for move in board.legal_moves:
-        if board.is_capture(move):
-            captures.append(move)
+        # king can't capture a defended piece
+        if piece_type == KING and board._attackers_mask(not color, to_square, occupied) & occupied:
+            break
+
+        gains.append(MG_PIECE_VALUES[on_square] - gains[-1])
+        # neither side can improve by continuing the exchange
+        if max(-gains[-2], gains[-1]) < 0:
+            break
+
+        on_square = piece_type
+        occupied ^= BB_SQUARES[lsb(piece_attackers)]
+        color = not color
+
+    # each side can stop capturing when it's better to do so
+    for i in range(len(gains) - 1, 0, -1):
+        gains[i - 1] = -max(-gains[i - 1], gains[i])
+    return gains[0]
+
+
+class MoveOrdering:
+    """
+    Move ordering state owned by the engine. It keeps killer moves
+    (quiet moves that caused a beta-cutoff at the same ply) and a
+    history table (how often a quiet move caused a cutoff, weighted by
+    depth), which persist across iterative deepening iterations.
+
+    The history table can live in shared memory, so every process
+    of a parallel search learns from the cutoffs found by the others.
+    """
+
+    def __init__(self, shared: bool = False):
+        """
+        Arguments:
+            - shared: if True, the history table is kept in shared memory.
+        """
+        self.killers: List[List[Optional[Move]]] = [[None] * KILLER_SLOTS for _ in range(MAX_PLY)]
+        self.buffer: Optional[SharedBuffer] = None
+        self.history: MutableSequence[int]
+        if shared:
+            self.buffer = SharedBuffer(HISTORY_SIZE * 4)
+            self.history = self.buffer.cast("i")
         else:
-            non_captures.append(move)
+            self.history = array("i", bytes(HISTORY_SIZE * 4))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.buffer is not None:
+            # the history will be mapped again from shared memory
+            del state["history"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.buffer is not None:
+            self.history = self.buffer.cast("i")
+
+    def organize_moves(self, board: Board, ply: int = 0, hash_move: Optional[Move] = None) -> List[Move]:
+        """
+        This function receives a board and it returns a list of all the
+        possible moves for the current player, sorted by importance:
+            1. the best move from a previous search (hash move)
+            2. captures and promotions, sorted by MVV-LVA
+            3. killer moves for this ply
+            4. remaining quiet moves, sorted by their history score
+
+        Arguments:
+                - board: chess board state
+                - ply: distance from the root of the search.
+                - hash_move: best move found for this board by a previous search.
+
+        Returns:
+                - legal_moves: list of all the possible moves for the current player.
+        """
+        hash_moves = []
+        captures = []
+        killers = []
+        quiet_moves = []
+        ply_killers = self.killers[ply] if ply < MAX_PLY else []
+
+        for move in board.legal_moves:
+            if move == hash_move:
+                hash_moves.append(move)
+            elif move.promotion or board.is_capture(move):
+                captures.append(move)
+            elif move in ply_killers:
+                killers.append(move)
+            else:
+                quiet_moves.append(move)
+
+        captures.sort(key=lambda move: capture_score(board, move), reverse=True)
+        killers.sort(key=ply_killers.index)
+        history = self.history
+        turn = board.turn
+        quiet_moves.sort(key=lambda move: history[history_index(turn, move)], reverse=True)
+        return hash_moves + captures + killers + quiet_moves
+
+    def update(self, board: Board, move: Move, depth: int, ply: int):
+        """
+        Records a quiet move that caused a beta-cutoff.
+
+        Arguments:
+                - board: chess board state, before the move is made.
+                - move: move that caused the cutoff.
+                - depth: remaining depth of the search at this node.
+                - ply: distance from the root of the search.
+        """
+        if ply < MAX_PLY:
+            ply_killers = self.killers[ply]
+            if ply_killers[0] != move:
+                ply_killers[1:] = ply_killers[:-1]
+                ply_killers[0] = move
+
+        index = history_index(board.turn, move)
+        self.history[index] += depth * depth
+        if self.history[index] >= HISTORY_MAX:
+            self.age_history()
+
+    def age_history(self):
+        """
+        Halves all history scores, so recent cutoffs weight more than old ones.
+        """
+        history = self.history
+        for index in range(HISTORY_SIZE):
+            history[index] //= 2
+
+    def new_search(self):
+        """
+        Prepares the ordering state for a new search: killers are
+        position specific so they're cleared, history is aged.
+        """
+        for ply_killers in self.killers:
+            ply_killers[:] = [None] * KILLER_SLOTS
+        self.age_history()
 
-    random.shuffle(captures)
-    random.shuffle(non_captures)
-    return captures + non_captures
+    def clear(self):
+        """
+        Resets killers and history scores.
+        """
+        for ply_killers in self.killers:
+            ply_killers[:] = [None] * KILLER_SLOTS
+        history = self.history
+        for index in range(HISTORY_SIZE):
+            history[index] = 0
 
 
 def organize_moves_quiescence(board: Board):
@@ -1,9 +1,7 @@
 # flake8: noqa
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
-from config import Config
 import chess
-import chess.syzygy
 
 ############
 # I'm using Pesto Evaluation function:
@@ -169,6 +167,27 @@ EG_PESTO = {
     chess.KING: EG_KING,
 }
 
+############
+# Fused tables: piece value + piece-square table for each color and piece
+# type, as flat lists indexed by square. Tables above are written from
+# white's point of view with a8 as first square, so white squares are
+# flipped (square ^ 56) and black squares are used as is.
+############
+MG_TABLES: List[List[List[int]]] = [[[], [], [], [], [], [], []], [[], [], [], [], [], [], []]]
+EG_TABLES: List[List[List[int]]] = [[[], [], [], [], [], [], []], [[], [], [], [], [], [], []]]
+for _color in chess.COLORS:
+    for _piece_type in chess.PIECE_TYPES:
+        MG_TABLES[_color][_piece_type] = [
+            MG_PESTO[_piece_type][square ^ 56 if _color == chess.WHITE else square]
+            + MG_PIECE_VALUES[_piece_type]
+            for square in chess.SQUARES
+        ]
+        EG_TABLES[_color][_piece_type] = [
+            EG_PESTO[_piece_type][square ^ 56 if _color == chess.WHITE else square]
+            + EG_PIECE_VALUES[_piece_type]
+            for square in chess.SQUARES
+        ]
+
 ############
 # Tapered Evaluation: https://www.chessprogramming.org/Tapered_Eval
 # Phase values are used to determine on what phase of the game
@@ -206,16 +225,16 @@ def count_pieces(board: chess.Board) -> List[int]:
         and their phase value.
     """
 
-    wp = len(board.pieces(chess.PAWN, chess.WHITE))
-    wn = len(board.pieces(chess.KNIGHT, chess.WHITE))
-    wb = len(board.pieces(chess.BISHOP, chess.WHITE))
-    wr = len(board.pieces(chess.ROOK, chess.WHITE))
-    wq = len(board.pieces(chess.QUEEN, chess.WHITE))
-    bp = len(board.pieces(chess.PAWN, chess.BLACK))
-    bn = len(board.pieces(chess.KNIGHT, chess.BLACK))
-    bb = len(board.pieces(chess.BISHOP, chess.BLACK))
-    br = len(board.pieces(chess.ROOK, chess.BLACK))
-    bq = len(board.pieces(chess.QUEEN, chess.BLACK))
+    wp = chess.popcount(board.pieces_mask(chess.PAWN, chess.WHITE))
+    wn = chess.popcount(board.pieces_mask(chess.KNIGHT, chess.WHITE))
+    wb = chess.popcount(board.pieces_mask(chess.BISHOP, chess.WHITE))
+    wr = chess.popcount(board.pieces_mask(chess.ROOK, chess.WHITE))
+    wq = chess.popcount(board.pieces_mask(chess.QUEEN, chess.WHITE))
+    bp = chess.popcount(board.pieces_mask(chess.PAWN, chess.BLACK))
+    bn = chess.popcount(board.pieces_mask(chess.KNIGHT, chess.BLACK))
+    bb = chess.popcount(board.pieces_mask(chess.BISHOP, chess.BLACK))
+    br = chess.popcount(board.pieces_mask(chess.ROOK, chess.BLACK))
+    bq = chess.popcount(board.pieces_mask(chess.QUEEN, chess.BLACK))
 
     return [
         wp,
@@ -252,18 +271,6 @@ def get_phase(board: chess.Board) -> float:
     return phase
 
 
-BOARD_EVALUATION_CACHE = {}
-def board_evaluation_cache(fun):
-
-    def inner(board: chess.Board):
-        key = board.fen()
-        if key not in BOARD_EVALUATION_CACHE:
-            BOARD_EVALUATION_CACHE[key] = fun(board)
-        return BOARD_EVALUATION_CACHE[key]
-    return inner
-
-
-@board_evaluation_cache
 def board_evaluation(board: chess.Board) -> float:
     """
     This functions receives a board and assigns a value to it, it acts as
@@ -280,39 +287,17 @@ def board_evaluation(board: chess.Board) -> float:
 
     phase = get_phase(board)
 
-    mg = {
-        chess.WHITE: 0,
-        chess.BLACK: 0,
-    }
-    eg = {
-        chess.WHITE: 0,
-        chess.BLACK: 0,
-    }
-
-    # loop through all squares and sum their piece values for both sides
-    for square in range(64):
-        piece = board.piece_at(square)
-        if piece is None:
-            continue
-
-        if piece.color == chess.WHITE:
-            mg[piece.color] += (
-                MG_PESTO[piece.piece_type][square ^ 56]
-                + MG_PIECE_VALUES[piece.piece_type]
-            )
-            eg[piece.color] += (
-                EG_PESTO[piece.piece_type][square ^ 56]
-                + EG_PIECE_VALUES[piece.piece_type]
-            )
-        if piece.color == chess.BLACK:
-            mg[piece.color] += (
-                MG_PESTO[piece.piece_type][square]
-                + MG_PIECE_VALUES[piece.piece_type]
-            )
-            eg[piece.color] += (
-                EG_PESTO[piece.piece_type][square]
-                + EG_PIECE_VALUES[piece.piece_type]
-            )
+    mg = [0, 0]
+    eg = [0, 0]
+
+    # walk the pieces of each type and sum their values for both sides
+    for color in chess.COLORS:
+        for piece_type in chess.PIECE_TYPES:
+            mg_table = MG_TABLES[color][piece_type]
+            eg_table = EG_TABLES[color][piece_type]
+            for square in chess.scan_forward(board.pieces_mask(piece_type, color)):
+                mg[color] += mg_table[square]
+                eg[color] += eg_table[square]
 
     # calculate board score based on phase
     mg_score = mg[board.turn] - mg[not board.turn]
@@ -339,24 +324,11 @@ def evaluate_piece(board: chess.Board, square: chess.Square, phase: float) -> fl
     eg_score = 0
 
     # get mid and end game score for single piece
-    piece = board.piece_at(square)
-    if piece is not None:
-        if piece.color == chess.WHITE:
-            mg_score += (
-                MG_PESTO[piece.piece_type][square ^ 56]
-                + MG_PIECE_VALUES[piece.piece_type]
-            )
-            eg_score += (
-                EG_PESTO[piece.piece_type][square ^ 56]
-                + EG_PIECE_VALUES[piece.piece_type]
-            )
-        if piece.color == chess.BLACK:
-            mg_score += (
-                MG_PESTO[piece.piece_type][square] + MG_PIECE_VALUES[piece.piece_type]
-            )
-            eg_score += (
-                EG_PESTO[piece.piece_type][square] + EG_PIECE_VALUES[piece.piece_type]
-            )
+    piece_type = board.piece_type_at(square)
+    if piece_type is not None:
+        color = bool(board.occupied_co[chess.WHITE] & chess.BB_SQUARES[square])
+        mg_score = MG_TABLES[color][piece_type][square]
+        eg_score = EG_TABLES[color][piece_type][square]
 
     # evaluate piece value based on phase
     eval = ((mg_score * (256 - phase)) + (eg_score * phase)) / 256
@@ -397,3 +369,124 @@ def evaluate_capture(board: chess.Board, move: chess.Move, phase: float) -> floa
     # evaluate capture based on game's phase
     eval = ((mg_score * (256 - phase)) + (eg_score * phase)) / 256
     return eval
+
+
+# phase value of each piece type, kings don't count
+PIECE_PHASE = {
+    chess.PAWN: PAWN_PHASE,
+    chess.KNIGHT: KNIGHT_PHASE,
+    chess.BISHOP: BISHOP_PHASE,
+    chess.ROOK: ROOK_PHASE,
+    chess.QUEEN: QUEEN_PHASE,
+    chess.KING: 0,
+}
+
+
+def piece_square_values(piece_type: chess.PieceType, color: chess.Color, square: chess.Square) -> Tuple[int, int]:
+    """
+    Returns the middle game and end game values (piece value + piece-square table)
+    of a piece on a given square.
+    """
+    return MG_TABLES[color][piece_type][square], EG_TABLES[color][piece_type][square]
+
+
+class IncrementalEvaluation:
+    """
+    PeSTO evaluation that's updated move by move instead of
+    being computed from scratch for every board.
+
+    It keeps the middle game and end game sums of each side and
+    the phase of the game. The search calls `push` before making
+    a move and `pop` after taking it back, so only the pieces that
+    moved are added or removed and evaluating a board is O(1).
+    """
+
+    def __init__(self, board: Optional[chess.Board] = None):
+        self.mg = [0, 0]
+        self.eg = [0, 0]
+        self.phase_material = 0
+        self.stack: List[Tuple[int, int, int, int, int]] = []
+        if board is not None:
+            self.reset(board)
+
+    def reset(self, board: chess.Board):
+        """
+        Computes the evaluation state from scratch for the given board.
+        """
+        self.mg = [0, 0]
+        self.eg = [0, 0]
+        self.phase_material = 0
+        self.stack = []
+        for square, piece in board.piece_map().items():
+            self._add(piece.piece_type, piece.color, square)
+
+    def _add(self, piece_type: chess.PieceType, color: chess.Color, square: chess.Square):
+        mg, eg = piece_square_values(piece_type, color, square)
+        self.mg[color] += mg
+        self.eg[color] += eg
+        self.phase_material += PIECE_PHASE[piece_type]
+
+    def _remove(self, piece_type: chess.PieceType, color: chess.Color, square: chess.Square):
+        mg, eg = piece_square_values(piece_type, color, square)
+        self.mg[color] -= mg
+        self.eg[color] -= eg
+        self.phase_material -= PIECE_PHASE[piece_type]
+
+    def push(self, board: chess.Board, move: chess.Move):
+        """
+        Updates the evaluation for a move. It must be called
+        before the move is pushed to the board.
+        """
+        self.stack.append((self.mg[0], self.mg[1], self.eg[0], self.eg[1], self.phase_material))
+
+        # null move doesn't change any piece
+        if not move:
+            return
+
+        color = board.turn
+        piece_type = board.piece_type_at(move.from_square)
+        assert piece_type is not None
+
+        # remove captured piece
+        if board.is_en_passant(move):
+            self._remove(chess.PAWN, not color, move.to_square + (-8 if color == chess.WHITE else 8))
+        else:
+            captured = board.piece_type_at(move.to_square)
+            if captured is not None:
+                self._remove(captured, not color, move.to_square)
+
+        # move rook when castling
+        if board.is_castling(move):
+            if chess.square_file(move.to_square) == 6:
+                rook_from, rook_to = move.to_square + 1, move.to_square - 1
+            else:
+                rook_from, rook_to = move.to_square - 2, move.to_square + 1
+            self._remove(chess.ROOK, color, rook_from)
+            self._add(chess.ROOK, color, rook_to)
+
+        # move piece, promoting it if needed
+        self._remove(piece_type, color, move.from_square)
+        self._add(move.promotion or piece_type, color, move.to_square)
+
+    def pop(self):
+        """
+        Restores the evaluation from before the last pushed move.
+        """
+        self.mg[0], self.mg[1], self.eg[0], self.eg[1], self.phase_material = self.stack.pop()
+
+    def phase(self) -> float:
+        """
+        Returns the phase of the game, same as `get_phase`.
+        """
+        phase = TOTAL_PHASE - self.phase_material
+        return (phase * 256 + (TOTAL_PHASE / 2)) / TOTAL_PHASE
+
+    def evaluate(self, turn: chess.Color) -> float:
+        """
+        Returns the evaluation of the board from the point
+        of view of the side to move, same as `board_evaluation`.
+        """
+        phase = self.phase()
+        mg_score = self.mg[turn] - self.mg[not turn]
+        eg_score = self.eg[turn] - self.eg[not turn]
+        return ((mg_score * (256 - phase)) + (eg_score * phase)) / 256
@@ -0,0 +1,388 @@
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import replace
+from multiprocessing import get_context
+from multiprocessing.sharedctypes import Synchronized
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+from chess import Board, Move
+
+from cache import LRUCache
+from config import SEARCH_OPTIONS, Config
+from engines.base_engine import ChessEngine
+from helper import get_engine
+
+# How often (in seconds) a streamed search checks if it was cancelled.
+CANCEL_INTERVAL = 0.1
+
+# How much later (in seconds) than the deadline of a request a running
+# search can stop for the request to wait for it instead of searching.
+COALESCE_WINDOW = 0.5
+
+# Engine used by the searches running in a worker process, with the
+# configuration it was created for. It's reused while requests ask for
+# the same engine (search options are applied to it), so the transposition
+# table and the worker processes of parallel engines aren't created for
+# every search.
+_worker_engine: Optional[Tuple[str, ChessEngine]] = None
+
+# Number of this worker process among the workers of the service, used to
+# give each one its own CPUs.
+_worker_index = 0
+
+
+class SearchResult(NamedTuple):
+    """
+    Result of a search run by a worker. Score, depth and nodes come from
+    the last completed iteration, they're None for engines that don't
+    search with iterative deepening.
+    """
+    move: Optional[str]
+    # False if the search was cut short by its deadline, before its depth
+    complete: bool
+    score: Optional[float] = None
+    depth: Optional[int] = None
+    nodes: Optional[int] = None
+    # seconds the search took
+    time: float = 0
+
+
+class SearchFailed(NamedTuple):
+    """
+    Sent by a streamed search that raised an error, instead of its best move.
+    """
+    error: str
+
+
+class QueueFull(Exception):
+    """
+    Raised when the search queue is full and the search should be retried later.
+    """
+
+
+def init_search_worker(worker_counter: Synchronized):
+    """
+    Executor initializer, numbers the worker processes.
+    """
+    global _worker_index
+    with worker_counter.get_lock():
+        _worker_index = worker_counter.value
+        worker_counter.value += 1
+
+
+def engine_threads(config: Config) -> int:
+    """
+    Returns how many threads the parallel engines of a worker process search
+    with. Unless they're configured, the CPUs (the ones the engine is pinned
+    to, if any) are divided between the workers, so all of them searching at
+    once don't start more processes than CPUs.
+    """
+    if config.threads:
+        return config.threads
+    cpus = len(config.cpu_affinity) if config.cpu_affinity else os.cpu_count() or 1
+    return max(cpus // (config.api_workers or os.cpu_count() or 1), 1)
+
+
+def worker_cpus(config: Config, index: int) -> Optional[List[int]]:
+    """
+    Returns the CPUs the engine of a worker process is pinned to: the CPUs
+    of `cpu_affinity` are divided between the workers, so their engines
+    don't all run on the same ones. Workers share a CPU only when there
+    are more workers than CPUs.
+
+    Arguments:
+        - config: engine configuration.
+        - index: number of the worker process, from 0.
+    """
+    cpus = config.cpu_affinity
+    if not cpus:
+        return cpus
+    workers = config.api_workers or os.cpu_count() or 1
+    index %= workers
+    first, last = index * len(cpus) // workers, (index + 1) * len(cpus) // workers
+    return cpus[first:last] or [cpus[first]]
+
+
+def worker_engine(config: Config) -> ChessEngine:
+    """
+    Returns the engine of this worker process for the configuration,
+    creating it again only when the engine options change.
+    """
+    global _worker_engine
+    # the depth is given to each search and search options are
+    # applied to the engine, so they don't need a new one
+    ignored = ("negamax_depth", *SEARCH_OPTIONS)
+    key = repr({field: value for field, value in vars(config).items() if field not in ignored})
+    if _worker_engine is None or _worker_engine[0] != key:
+        if _worker_engine is not None:
+            _worker_engine[1].close()
+        engine_config = replace(
+            config, threads=engine_threads(config), cpu_affinity=worker_cpus(config, _worker_index),
+        )
+        _worker_engine = (key, get_engine(engine_config))
+    engine = _worker_engine[1]
+    engine.configure(config)
+    return engine
+
+
+def search_position(
+    config: Config, fen: str, depth: Optional[int], deadline: Optional[float],
+) -> SearchResult:
+    """
+    Searches a position in a worker process.
+
+    Arguments:
+        - config: engine configuration.
+        - fen: position to search.
+        - depth: maximum depth to search, if None we search until the deadline.
+        - deadline: time (as given by time.time) at which the best move found
+            so far is returned. If the search starts after the deadline, its
+            first iteration is cut short and we play the best root move it found.
+
+    Returns:
+        - result: best move found in UCI notation (None if there are no
+            legal moves), if the search reached its depth (or ended before
+            the deadline, without depth), and the details of the search.
+    """
+    engine = worker_engine(config)
+    engine.clear_stop()
+    start = time.time()
+    time_limit = None if deadline is None else max(deadline - start, 0)
+    move = engine.search_move(Board(fen), depth, time_limit)
+    end = time.time()
+    info = getattr(engine, "last_search", None)
+
+    if depth is None:
+        complete = deadline is None or end < deadline
+    else:
+        # iterative deepening also stops before the deadline when the next
+        # iteration wouldn't finish in time, so we check the depth reached
+        complete = info is not None and info.depth >= depth
+    result = SearchResult(
+        move=None if move is None else Move.from_uci(str(move)).uci(),
+        complete=complete,
+        time=end - start,
+    )
+    if info is not None and info.move is not None and info.move.uci() == result.move:
+        result = result._replace(score=info.score, depth=info.depth, nodes=info.nodes)
+    return result
+
+
+def stop_when_cancelled(engine: ChessEngine, cancel: Any, done: threading.Event):
+    """
+    Stops the search of the engine if it's cancelled before it's done.
+    """
+    while not done.is_set():
+        if cancel.wait(CANCEL_INTERVAL):
+            engine.stop()
+            return
+
+
+def stream_position(
+    config: Config, fen: str, depth: Optional[int], deadline: Optional[float], updates: Any, cancel: Any,
+):
+    """
+    Searches a position in a worker process, sending the SearchInfo of each
+    completed iteration to the updates queue as soon as it's available, then
+    the best move (or SearchFailed if the search raised an error), and None
+    once the search is done. It's the same search as
+    `search_position` (e.g. in parallel), its progress comes from `on_iteration`.
+
+    Arguments:
+        - config: engine configuration.
+        - fen: position to search.
+        - depth: maximum depth to search, if None we search until the deadline.
+        - deadline: time (as given by time.time) at which the search stops.
+        - updates: queue shared with the server (e.g. from a Manager).
+        - cancel: event shared with the server, the search stops when it's set.
+    """
+    engine = worker_engine(config)
+    engine.clear_stop()
+    board = Board(fen)
+    time_limit = None if deadline is None else max(deadline - time.time(), 0)
+
+    done = threading.Event()
+    watcher = threading.Thread(target=stop_when_cancelled, args=(engine, cancel, done), daemon=True)
+    watcher.start()
+    # only the best line of each iteration is streamed
+    engine.on_iteration = lambda lines: updates.put(lines[0])
+    try:
+        best_move = engine.search_move(board, depth, time_limit)
+        updates.put(None if best_move is None else Move.from_uci(str(best_move)).uci())
+    except Exception as error:
+        updates.put(SearchFailed(repr(error)))
+        raise
+    finally:
+        engine.on_iteration = None
+        done.set()
+        watcher.join()
+        updates.put(None)
+
+
+def result_key(config: Config, fen: str, depth: Optional[int]) -> Hashable:
+    """
+    Returns the key of a search in the result cache: the position (without
+    the move number, which doesn't change the search) and the search options
+    that requests can change.
+    """
+    position = Board(fen).fen().rsplit(" ", 1)[0]
+    return (
+        position,
+        config.algorithm,
+        depth,
+        config.null_move,
+        config.null_move_r,
+        config.quiescence_search_depth,
+    )
+
+
+class SearchService:
+    """
+    Runs searches in a fixed pool of worker processes, so a deep
+    search doesn't block the searches of other requests.
+
+    Searches wait in a bounded queue until a worker is free. When the
+    queue is full new searches are rejected right away (`QueueFull`)
+    instead of making every request slower.
+
+    Results of fixed depth searches are kept in a LRU cache for a while
+    (`api_cache_size` and `api_cache_ttl`), and identical searches requested
+    while one is running wait for it instead of searching again, unless it
+    stops before their deadline.
+    """
+
+    def __init__(self, config: Config):
+        """
+        Arguments:
+            - config: server configuration, with the number of workers
+                (`api_workers`) and the size of the queue (`api_queue_size`).
+        """
+        self.config = config
+        self.workers = config.api_workers or os.cpu_count() or 1
+        # searches running in a worker or waiting for one
+        self.capacity = self.workers + config.api_queue_size
+        self.pending = 0
+        # reentrant, as callbacks of searches that are already done run right away
+        self.lock = threading.RLock()
+        self.results: LRUCache[SearchResult] = LRUCache(config.api_cache_size, config.api_cache_ttl)
+        # searches running (or queued) and their deadline, by result key
+        self.in_flight: Dict[Hashable, Tuple[Future, Optional[float]]] = {}
+        self.coalesced = 0
+        context = get_context(config.start_method)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=init_search_worker,
+            initargs=(context.Value("i", 0),),
+        )
+        # workers are started now, before the server starts its request threads
+        self.executor.submit(os.getpid).result()
+        # queues and events shared with the workers by streamed searches
+        self.manager = context.Manager()
+
+    def submit(self, function: Any, *args: Any) -> Future:
+        """
+        Queues a call to a function in a worker process.
+
+        Raises:
+            - QueueFull: if there are already too many searches waiting.
+        """
+        with self.lock:
+            if self.pending >= self.capacity:
+                raise QueueFull()
+            self.pending += 1
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, _: Future):
+        with self.lock:
+            self.pending -= 1
+
+    def search(self, config: Config, fen: str, depth: Optional[int], deadline: Optional[float]) -> Future:
+        """
+        Queues the search of a position, see `search_position`. Cached
+        results are returned right away, and a search that's already
+        running is shared instead of starting a new one, if it stops at
+        the deadline or a bit later (`COALESCE_WINDOW`): a search stopping
+        earlier may not be as deep, and one stopping much later would keep
+        the request waiting past its deadline.
+
+        Raises:
+            - QueueFull: if there are already too many searches waiting.
+        """
+        # searches until a deadline depend on how fast they run, so they aren't reused
+        if depth is None:
+            return self.submit(search_position, config, fen, depth, deadline)
+
+        key = result_key(config, fen, depth)
+        with self.lock:
+            result = self.results.get(key)
+            if result is not None:
+                future: Future = Future()
+                future.set_result(result)
+                return future
+
+            running = self.in_flight.get(key)
+            if running is not None:
+                running_search, running_deadline = running
+                stops = math.inf if running_deadline is None else running_deadline
+                requested = math.inf if deadline is None else deadline
+                if requested <= stops <= requested + COALESCE_WINDOW:
+                    self.coalesced += 1
+                    return running_search
+
+            future = self.submit(search_position, config, fen, depth, deadline)
+            self.in_flight[key] = (future, deadline)
+            future.add_done_callback(lambda search: self._store(key, search))
+            return future
+
+    def _store(self, key: Hashable, search: Future):
+        with self.lock:
+            # a search with another deadline may have replaced it
+            if key in self.in_flight and self.in_flight[key][0] is search:
+                del self.in_flight[key]
+            # searches cut short before their depth aren't cached,
+            # later requests would get a shallower result than asked
+            if not search.cancelled() and search.exception() is None and search.result().complete:
+                self.results.put(key, search.result())
+
+    def stream(
+        self, config: Config, fen: str, depth: Optional[int], deadline: Optional[float],
+    ) -> Tuple[Future, Any, Any]:
+        """
+        Queues the search of a position whose progress is streamed, see `stream_position`.
+
+        Returns:
+            - search, updates, cancel: the queued search, queue receiving
+                its progress, and event to set to stop it.
+
+        Raises:
+            - QueueFull: if there are already too many searches waiting.
+        """
+        updates, cancel = self.manager.Queue(), self.manager.Event()
+        search = self.submit(stream_position, config, fen, depth, deadline, updates, cancel)
+        return search, updates, cancel
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the result cache statistics, with how many requests
+        waited for an identical search and how many searches are pending.
+        """
+        with self.lock:
+            return {
+                **self.results.stats(),
+                "coalesced": self.coalesced,
+                "in_flight": len(self.in_flight),
+                "pending": self.pending,
+            }
+
+    def close(self):
+        """
+        Cancels the queued searches and stops the worker processes.
+        """
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.manager.shutdown()
@@ -0,0 +1,54 @@
+import weakref
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, List, MutableSequence, Optional, cast
+
+
+def _release(shared_memory: SharedMemory, views: List[memoryview], unlink: bool):
+    # views need to be released before the shared memory can be closed
+    for view in views:
+        view.release()
+    shared_memory.close()
+    if unlink:
+        shared_memory.unlink()
+
+
+class SharedBuffer:
+    """
+    A block of shared memory that can be sent to other processes.
+
+    Pickling a SharedBuffer only sends the name of the block, so the
+    receiving process maps the same memory instead of getting a copy.
+    The process that created the block removes it when the buffer is
+    garbage collected, closed or when the interpreter exits.
+    """
+
+    def __init__(self, size: int, name: Optional[str] = None):
+        """
+        Arguments:
+            - size: size of the buffer in bytes.
+            - name: name of an existing block to attach to, a new
+                block is created when it's not given.
+        """
+        create = name is None
+        self.size = size
+        self.shared_memory = SharedMemory(name=name, create=create, size=size if create else 0)
+        self._views: List[memoryview] = []
+        self._finalizer = weakref.finalize(self, _release, self.shared_memory, self._views, create)
+
+    def cast(self, format: str) -> MutableSequence[Any]:
+        """
+        Returns a view of the buffer with the given struct format, e.g. "i" or "Q".
+        """
+        view = self.shared_memory.buf.cast(format)
+        self._views.append(view)
+        # indexing the view reads and writes values of the format
+        return cast(MutableSequence[Any], view)
+
+    def close(self):
+        """
+        Releases the buffer, removing it if this process created it.
+        """
+        self._finalizer()
+
+    def __reduce__(self):
+        return (SharedBuffer, (self.size, self.shared_memory.name))
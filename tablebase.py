@@ -0,0 +1,112 @@
+import logging
+import os
+from typing import Dict, Optional, Tuple
+
+import chess
+import chess.syzygy
+from chess.polyglot import zobrist_hash
+
+from cache import LRUCache
+
+# Score for a position that's won according to the tablebases,
+# it's below the checkmate threshold so real mates are still preferred.
+TABLEBASE_WIN_SCORE = 10**6
+
+logger = logging.getLogger(__name__)
+
+# Tablebases opened by this process, indexed by (process id, path).
+# They're shared by every engine (and engine copy sent to a pool worker)
+# running in the process, so the table files are opened only once.
+_TABLEBASES: Dict[Tuple[int, str], chess.syzygy.Tablebase] = {}
+
+
+def open_tablebase(path: str) -> chess.syzygy.Tablebase:
+    """
+    Returns the syzygy tablebase for the given path,
+    opening it only the first time it's requested by this process.
+    """
+    key = (os.getpid(), path)
+    if key not in _TABLEBASES:
+        _TABLEBASES[key] = chess.syzygy.open_tablebase(path)
+    return _TABLEBASES[key]
+
+
+class TablebaseProber:
+    """
+    Probes syzygy endgame tablebases during search.
+
+    It uses WDL (win/draw/loss) tables, which are smaller and faster
+    than DTZ ones, and keeps a bounded cache of probe results indexed
+    by the Zobrist hash of the position.
+
+    If the tablebases can't be opened (e.g. the directory doesn't exist)
+    the error is logged and the prober is disabled, it finds no positions.
+    """
+
+    def __init__(self, path: str, max_pieces: int, cache_size: int):
+        """
+        Arguments:
+            - path: directory with the syzygy tablebase files.
+            - max_pieces: maximum number of pieces (including kings)
+                on the board to probe the tablebases.
+            - cache_size: number of probe results to keep in memory.
+        """
+        self.path = path
+        self.max_pieces = max_pieces
+        self.cache: LRUCache[Tuple[Optional[int]]] = LRUCache(cache_size)
+        self.disabled = False
+
+    def open(self) -> Optional[chess.syzygy.Tablebase]:
+        """
+        Returns the tablebase of the prober, or None if it can't be opened.
+        """
+        if self.disabled:
+            return None
+        try:
+            return open_tablebase(self.path)
+        except OSError as error:
+            logger.warning("Syzygy tablebases disabled, %s can't be opened: %s", self.path, error)
+            self.disabled = True
+            return None
+
+    def probe_wdl(self, board: chess.Board) -> Optional[int]:
+        """
+        Returns the WDL value of the board for the side to move: 2 for a
+        win, 1 for a win prevented by the 50 move rule, 0 for a draw, -1
+        and -2 for the equivalent losses. Returns None if the position
+        isn't available in the tablebases.
+        """
+        if self.disabled or chess.popcount(board.occupied) > self.max_pieces:
+            return None
+
+        key = zobrist_hash(board)
+        # missing positions are cached as well, so we store them as a tuple
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached[0]
+
+        tablebase = self.open()
+        if tablebase is None:
+            return None
+        try:
+            wdl: Optional[int] = tablebase.probe_wdl(board)
+        except (chess.syzygy.MissingTableError, KeyError):
+            wdl = None
+
+        self.cache.put(key, (wdl,))
+        return wdl
+
+    def score(self, board: chess.Board) -> Optional[int]:
+        """
+        Converts the WDL value of the board into a score for the side
+        to move, or returns None if the position isn't in the tablebases.
+        """
+        wdl = self.probe_wdl(board)
+        if wdl is None:
+            return None
+        if wdl == 2:
+            return TABLEBASE_WIN_SCORE
+        if wdl == -2:
+            return -TABLEBASE_WIN_SCORE
+        # wins/losses prevented by the 50 move rule are draws
+        return 0
@@ -0,0 +1,61 @@
+import time
+from multiprocessing import cpu_count
+
+from chess import Board
+import click
+
+from config import Config
+from engines.abdada import ABDADA
+from tests.test_bratko_kopec import POSITIONS
+
+############
+# Measures how the ABDADA search scales with the number of search
+# processes: each position is searched at a fixed depth with 1, 2, 4,
+# ... processes (the engine's and its helpers), and the speedup is the
+# time with one process divided by the time with N processes.
+############
+
+
+def worker_counts(max_processes: int):
+    processes = 1
+    while processes < max_processes:
+        yield processes
+        processes *= 2
+    yield max_processes
+
+
+@click.command()
+@click.option("--depth", type=int, help="Depth of the searches.", default=4)
+@click.option("--positions", type=int, help="Number of Bratko-Kopec positions to search.", default=6)
+@click.option("--max-processes", type=int, help="Maximum number of search processes.", default=cpu_count())
+def speedup_report(depth: int, positions: int, max_processes: int):
+    config = Config(
+        mode="uci",
+        algorithm="abdada",
+        negamax_depth=depth,
+        null_move=False,
+        null_move_r=2,
+        quiescence_search_depth=3,
+        syzygy_path=None,
+        syzygy_pieces=5,
+    )
+
+    print("| Processes | Time (s) | Speedup |")
+    print("|-----------|----------|---------|")
+    base_time = None
+    for processes in worker_counts(max_processes):
+        # the engine's process searches too
+        engine = ABDADA(config, processes - 1)
+        start = time.perf_counter()
+        for fen, _ in POSITIONS[:positions]:
+            engine.search_move(Board(fen))
+        elapsed = time.perf_counter() - start
+        engine.close()
+
+        if base_time is None:
+            base_time = elapsed
+        print(f"| {processes} | {elapsed:.2f} | {base_time / elapsed:.2f}x |", flush=True)
+
+
+if __name__ == "__main__":
+    speedup_report()
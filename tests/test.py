@@ -1,10 +1,56 @@
+import contextlib
+import io
+import json
+import os
+import pickle
+import queue
+import random
+import struct
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import Future
+from dataclasses import replace
 
-from chess import Board, Move
+from chess import BLACK, WHITE, Board, Move
+from chess.polyglot import zobrist_hash
 from parameterized import parameterized
 
+from batch_evaluation import evaluate_boards
+from book import OpeningBook
+from cache import LRUCache
 from config import Config
+from engines.abdada import BUSY_SLOTS
+from engines.alpha_beta import MAX_DEPTH
+from engines.parallel_alpha_beta import pack_board, unpack_board, worker_call
 from helper import get_engine
+from mode.api import search_events, setup
+from mode.uci import (
+    UCI_OPTIONS,
+    option_command,
+    parse_go,
+    parse_setoption,
+    score_command,
+    set_option,
+    start_search,
+    update_position,
+)
+from move_ordering import MoveOrdering, static_exchange_evaluation
+from psqt import IncrementalEvaluation, board_evaluation
+from search_service import (
+    COALESCE_WINDOW,
+    QueueFull,
+    SearchFailed,
+    engine_threads,
+    search_position,
+    stream_position,
+    worker_cpus,
+    worker_engine,
+)
+from tablebase import TablebaseProber
+from time_management import time_budget
+from transposition_table import EXACT, LOWER, SharedTranspositionTable, TranspositionTable, pack_move
 
 test_boards = [
     (Board("4r2K/8/8/8/8/7r/8/3k4 w - - 0 1"), 1, [Move.from_uci("h8g7")]),
@@ -105,6 +151,47 @@ class Testunctions(unittest.TestCase):
         result = engine.search_move(board)
         self.assertIn(result, expected_result)
 
+    @parameterized.expand(test_boards)
+    def test_alpha_beta_pvs(self, board, depth, expected_result):
+        config = Config(
+            mode="uci",
+            algorithm="alpha_beta",
+            negamax_depth=depth,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+            pvs=True,
+            aspiration=True,
+        )
+
+        engine = get_engine(config)
+        result = engine.search_move(board)
+        self.assertIn(result, expected_result)
+
+    @parameterized.expand(test_boards)
+    def test_alpha_beta_pruning(self, board, depth, expected_result):
+        config = Config(
+            mode="uci",
+            algorithm="alpha_beta",
+            negamax_depth=depth,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+            see_pruning=True,
+            delta_pruning=True,
+            lmr=True,
+            futility=True,
+            reverse_futility=True,
+        )
+
+        engine = get_engine(config)
+        result = engine.search_move(board)
+        self.assertIn(result, expected_result)
+
     @parameterized.expand(test_boards)
     def test_parallel_alpha_beta_layer_1(self, board, depth, expected_result):
         config = Config(
@@ -119,6 +206,7 @@ class Testunctions(unittest.TestCase):
         )
         engine = get_engine(config)
         result = engine.search_move(board)
+        engine.close()
         self.assertIn(result, expected_result)
 
     @parameterized.expand(test_boards)
@@ -135,6 +223,7 @@ class Testunctions(unittest.TestCase):
         )
         engine = get_engine(config)
         result = engine.search_move(board)
+        engine.close()
         self.assertIn(result, expected_result)
 
     @parameterized.expand(test_boards)
@@ -152,8 +241,975 @@ class Testunctions(unittest.TestCase):
 
         engine = get_engine(config)
         result = engine.search_move(board)
+        engine.close()
         self.assertIn(result, expected_result)
 
+    @parameterized.expand(test_boards)
+    def test_abdada(self, board, depth, expected_result):
+        config = Config(
+            mode="uci",
+            algorithm="abdada",
+            negamax_depth=depth,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+        )
+
+        engine = get_engine(config)
+        result = engine.search_move(board)
+        engine.close()
+        self.assertIn(result, expected_result)
+
+
+class TestParallelEngines(unittest.TestCase):
+
+    def test_abdada_defers_moves_searched_elsewhere(self):
+        config = Config(
+            mode="uci",
+            algorithm="abdada",
+            negamax_depth=2,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+            threads=2,
+        )
+        engine = get_engine(config)
+        board = Board()
+        moves = list(board.legal_moves)
+        # another process is searching the nodes after the first two moves
+        for move in moves[:2]:
+            board.push(move)
+            key = engine.cache.key(board)
+            engine.busy[key % BUSY_SLOTS] = key
+            board.pop()
+
+        # the eldest brother is searched first anyway
+        self.assertEqual(list(engine.search_order(board, moves, 2)), [moves[0], *moves[2:], moves[1]])
+        self.assertEqual(list(engine.search_order(board, moves, 1)), moves)
+        self.assertIn(engine.search_move(board), board.legal_moves)
+        engine.close()
+
+    @parameterized.expand([
+        ("parallel_alpha_beta_layer_1",),
+        ("parallel_alpha_beta_layer_2",),
+        ("lazy_smp",),
+        ("abdada",),
+    ])
+    def test_pool_reused_across_moves(self, algorithm):
+        config = Config(
+            mode="uci",
+            algorithm=algorithm,
+            negamax_depth=2,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+        )
+        engine = get_engine(config)
+        pool = engine.pool
+        board = Board()
+        for _ in range(2):
+            move = engine.search_move(board)
+            self.assertIn(move, board.legal_moves)
+            board.push(move)
+        # every search ran on the pool created with the engine
+        self.assertIs(engine.pool, pool)
+
+        engine.close()
+        self.assertIsNone(engine.pool)
+
+    @parameterized.expand([
+        ("parallel_alpha_beta_layer_1",),
+        ("parallel_alpha_beta_layer_2",),
+        ("lazy_smp",),
+    ])
+    def test_nodes_include_workers(self, algorithm):
+        config = Config(
+            mode="uci",
+            algorithm=algorithm,
+            negamax_depth=2,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+            threads=2,
+        )
+        engine = get_engine(config)
+        engine.search_move(Board())
+        engine.close()
+
+        # layer 2 only searches in the workers
+        self.assertGreater(engine.nodes, 0)
+        if engine.last_search is not None:
+            self.assertEqual(engine.last_search.nodes, engine.nodes)
+
+    def test_configure_search_options(self):
+        config = Config(
+            mode="uci",
+            algorithm="parallel_alpha_beta_layer_1",
+            negamax_depth=2,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+            threads=1,
+        )
+        engine = get_engine(config)
+        pool = engine.pool
+        engine.search_move(Board())
+        options = {"null_move": True, "quiescence_search_depth": 1}
+        engine.configure(replace(config, **options))
+
+        self.assertIs(engine.pool, pool)
+        self.assertEqual(len(engine.cache), 0)
+        # the worker already applied the options before this task
+        self.assertFalse(engine.pool.apply(worker_call, ("apply_search_options", options)))
+        self.assertIn(engine.search_move(Board()), Board().legal_moves)
+        engine.close()
+
+    @parameterized.expand([
+        ("parallel_alpha_beta_layer_1",),
+        ("parallel_alpha_beta_layer_2",),
+    ])
+    def test_layer_search_respects_time_limit(self, algorithm):
+        config = Config(
+            mode="uci",
+            algorithm=algorithm,
+            negamax_depth=8,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+            threads=2,
+        )
+        engine = get_engine(config)
+        board = Board("r1bqkb1r/4npp1/p1p4p/1p1pP1B1/8/1B6/PPPN1PPP/R2Q1RK1 w kq - 0 1")
+
+        start = time.monotonic()
+        move = engine.search_move(board, time_limit=0.5)
+        elapsed = time.monotonic() - start
+        # the workers are idle again
+        self.assertIn(engine.search_move(board, depth=1), board.legal_moves)
+        engine.close()
+
+        self.assertLess(elapsed, 2)
+        self.assertIn(move, board.legal_moves)
+
+    @parameterized.expand([
+        ("parallel_alpha_beta_layer_1",),
+        ("parallel_alpha_beta_layer_2",),
+    ])
+    def test_layer_search_info(self, algorithm):
+        config = Config(
+            mode="uci",
+            algorithm=algorithm,
+            negamax_depth=2,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+            threads=2,
+        )
+        engine = get_engine(config)
+        board = Board()
+        move = engine.search_move(board)
+        engine.close()
+
+        info = engine.last_search
+        self.assertEqual((info.depth, info.move, info.nodes), (2, move, engine.nodes))
+        self.assertEqual(info.pv[0], move)
+
+    @parameterized.expand([
+        ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",),
+        ("r1bqkb1r/4npp1/p1p4p/1p1pP1B1/8/1B6/PPPN1PPP/R2Q1RK1 w kq d6 0 12",),
+        ("8/P7/8/8/8/8/8/k6K w - - 37 80",),
+    ])
+    def test_packed_board(self, fen):
+        board = Board(fen)
+        self.assertEqual(unpack_board(pack_board(board)).fen(), fen)
+
+        move = next(iter(board.legal_moves))
+        unpacked = unpack_board(pack_board(board), (pack_move(move),))
+        board.push(move)
+        self.assertEqual(unpacked.fen(), board.fen())
+
+    def test_threads_affinity_and_start_method(self):
+        cpus = sorted(os.sched_getaffinity(0))
+        config = Config(
+            mode="uci",
+            algorithm="parallel_alpha_beta_layer_1",
+            negamax_depth=2,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+            threads=2,
+            cpu_affinity=cpus,
+            start_method="spawn",
+        )
+        engine = get_engine(config)
+        self.assertEqual(engine.processes, 2)
+        # each worker is pinned to one of the CPUs
+        worker_cpus = engine.pool.apply(os.sched_getaffinity, (0,))
+        self.assertEqual(len(worker_cpus), 1)
+        self.assertTrue(worker_cpus <= set(cpus))
+
+        board = Board()
+        self.assertIn(engine.search_move(board), board.legal_moves)
+        engine.close()
+
+    def test_lazy_smp_helpers_stop_with_main_search(self):
+        config = Config(
+            mode="uci",
+            algorithm="lazy_smp",
+            negamax_depth=3,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+            threads=2,
+        )
+        engine = get_engine(config)
+        board = Board()
+        start = time.monotonic()
+        move = engine.search_move(board, time_limit=1)
+        elapsed = time.monotonic() - start
+        engine.close()
+
+        self.assertIn(move, board.legal_moves)
+        # helpers searching deeper don't keep the search running
+        self.assertLess(elapsed, 3)
+
+
+class TestTranspositionTable(unittest.TestCase):
+
+    def test_probe_and_store(self):
+        cache = TranspositionTable(1)
+        board = Board()
+        key = cache.key(board)
+        self.assertIsNone(cache.probe(key))
+
+        cache.store(key, 3, 12.5, EXACT, Move.from_uci("e2e4"))
+        entry = cache.probe(key)
+        self.assertEqual(entry.depth, 3)
+        self.assertEqual(entry.score, 12.5)
+        self.assertEqual(entry.bound, EXACT)
+        self.assertEqual(entry.move, Move.from_uci("e2e4"))
+
+    def test_depth_preferred_replacement(self):
+        cache = TranspositionTable(1)
+        key = 5
+        other_key = key + cache.size
+
+        cache.store(key, 5, 1, EXACT, None)
+        # shallower search for a colliding position doesn't replace it
+        cache.store(other_key, 2, 2, LOWER, None)
+        self.assertIsNotNone(cache.probe(key))
+        self.assertIsNone(cache.probe(other_key))
+
+        # entries from older searches are always replaced
+        cache.new_search()
+        cache.store(other_key, 2, 2, LOWER, None)
+        self.assertIsNone(cache.probe(key))
+        self.assertIsNotNone(cache.probe(other_key))
+
+    def test_fixed_size(self):
+        cache = TranspositionTable(1)
+        for key in range(cache.size * 2):
+            cache.store(key, 1, 0, EXACT, None)
+        self.assertEqual(len(cache), cache.size)
+
+    def test_shared_table(self):
+        cache = SharedTranspositionTable(1)
+        key = cache.key(Board())
+        cache.store(key, 4, -31.25, LOWER, Move.from_uci("a7a8q"))
+
+        # a copy sent to another process maps the same memory
+        other = pickle.loads(pickle.dumps(cache))
+        entry = other.probe(key)
+        self.assertEqual(entry.depth, 4)
+        self.assertEqual(entry.score, -31.25)
+        self.assertEqual(entry.bound, LOWER)
+        self.assertEqual(entry.move, Move.from_uci("a7a8q"))
+
+        other.new_search()
+        self.assertEqual(cache.age, 1)
+
+        # a partially written entry doesn't verify
+        cache.words[(key % cache.size) * 3 + 1] ^= 1
+        self.assertIsNone(cache.probe(key))
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class TestUCI(unittest.TestCase):
+
+    def test_parse_go(self):
+        arguments = parse_go("go wtime 1000 btime 2000 winc 10 binc 20 movestogo 5".split(" "))
+        self.assertEqual(
+            arguments, {"wtime": 1000, "btime": 2000, "winc": 10, "binc": 20, "movestogo": 5},
+        )
+
+    def test_parse_setoption(self):
+        self.assertEqual(parse_setoption("setoption name Threads value 4"), ("Threads", "4"))
+        self.assertEqual(parse_setoption("setoption name Clear Hash"), ("Clear Hash", None))
+
+    def test_score_command(self):
+        config = Config(
+            mode="uci",
+            algorithm="alpha_beta",
+            negamax_depth=3,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+        )
+        self.assertEqual(score_command(35.5, config), "cp 35")
+        # mate scores lose one point per ply
+        self.assertEqual(score_command(config.checkmate_score - 1, config), "mate 1")
+        self.assertEqual(score_command(-config.checkmate_score + 2, config), "mate -1")
+
+    def test_update_position(self):
+        fen = Board().fen()
+        board, board_moves = Board(), []
+        # the game goes on, the same board is reused
+        same_board = update_position(board, fen, board_moves, fen, ["e2e4", "e7e5"])
+        self.assertIs(same_board, board)
+        board = update_position(board, fen, board_moves, fen, ["e2e4", "e7e5", "g1f3"])
+        self.assertIs(board, same_board)
+        self.assertEqual(board_moves, ["e2e4", "e7e5", "g1f3"])
+        # diverging games take back the moves that differ
+        board = update_position(board, fen, board_moves, fen, ["e2e4", "c7c5"])
+        self.assertEqual(board.fen(), "rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2")
+        self.assertEqual(board_moves, ["e2e4", "c7c5"])
+        # a new FEN starts a new board
+        other_fen = "8/8/8/8/8/4k3/8/4K2R w K - 0 1"
+        board = update_position(board, fen, board_moves, other_fen, ["e1g1"])
+        self.assertIsNot(board, same_board)
+        self.assertEqual(len(board.move_stack), 1)
+        self.assertEqual(board_moves, ["e1g1"])
+
+    def test_set_option(self):
+        config = Config(
+            mode="uci",
+            algorithm="alpha_beta",
+            negamax_depth=3,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+        )
+        self.assertTrue(set_option(config, "hash", "128"))
+        self.assertTrue(set_option(config, "MultiPV", "1000"))
+        self.assertTrue(set_option(config, "NullMove", "true"))
+        self.assertTrue(set_option(config, "SyzygyPath", "/tmp/syzygy"))
+        self.assertFalse(set_option(config, "Threads", "many"))
+        self.assertFalse(set_option(config, "Unknown", "1"))
+        self.assertEqual(config.hash_size, 128)
+        # values are clamped to the advertised range
+        self.assertEqual(config.multi_pv, 256)
+        self.assertTrue(config.null_move)
+        self.assertEqual(config.syzygy_path, "/tmp/syzygy")
+
+        self.assertTrue(set_option(config, "SyzygyPath", "<empty>"))
+        self.assertIsNone(config.syzygy_path)
+        self.assertEqual(
+            [option_command(option, config).split()[2] for option in UCI_OPTIONS],
+            [option.name for option in UCI_OPTIONS],
+        )
+
+    def test_multi_pv(self):
+        config = Config(
+            mode="uci",
+            algorithm="alpha_beta",
+            negamax_depth=3,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+            multi_pv=3,
+        )
+        engine = get_engine(config)
+        board = Board()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            start_search(engine, board, parse_go(["go", "depth", "2"]), config=config).join()
+
+        # the lines of each iteration, then the best move
+        commands = output.getvalue().splitlines()
+        self.assertEqual([command.split()[2] for command in commands[:-1]], ["1", "2", "3"] * 2)
+        self.assertEqual([command.split()[4] for command in commands[:-1]], ["1"] * 3 + ["2"] * 3)
+        moves = [command.split(" pv ")[1].split()[0] for command in commands[-4:-1]]
+        self.assertEqual(len(set(moves)), 3)
+        self.assertEqual(commands[-1].split()[1], moves[0])
+
+    def test_clear_keeps_nothing_from_previous_game(self):
+        config = Config(
+            mode="uci",
+            algorithm="alpha_beta",
+            negamax_depth=2,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+        )
+        engine = get_engine(config)
+        board = Board()
+        engine.search_move(board)
+        board.push_uci("e2e4")
+        engine.search_move(board)
+        # the table is kept between moves of the same game
+        self.assertIsNotNone(engine.cache.probe(engine.cache.key(Board())))
+        engine.clear()
+        self.assertEqual(len(engine.cache), 0)
+
+    @parameterized.expand([("alpha_beta",), ("lazy_smp",), ("abdada",)])
+    def test_stop_infinite_search(self, algorithm):
+        config = Config(
+            mode="uci",
+            algorithm=algorithm,
+            negamax_depth=3,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+            threads=2,
+        )
+        engine = get_engine(config)
+        board = Board()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            search = start_search(engine, board, parse_go(["go", "infinite"]), infinite=True)
+            time.sleep(0.5)
+            # still searching, the best move is only sent after stop
+            self.assertTrue(search.is_alive())
+            search.stop()
+        engine.close()
+
+        command = output.getvalue().split()
+        self.assertEqual(command[0], "bestmove")
+        self.assertIn(Move.from_uci(command[1]), board.legal_moves)
+
+    def test_best_move_sent_when_search_fails(self):
+        config = Config(
+            mode="uci",
+            algorithm="alpha_beta",
+            negamax_depth=2,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+        )
+        engine = get_engine(config)
+
+        def search_move(*_):
+            raise RuntimeError("broken search")
+
+        engine.search_move = search_move
+        board = Board()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            start_search(engine, board, parse_go(["go", "depth", "2"]), config=config).join()
+
+        commands = output.getvalue().splitlines()
+        self.assertTrue(commands[0].startswith("info string"))
+        # the first legal move is played
+        self.assertEqual(commands[-1].split()[:2], ["bestmove", next(iter(board.legal_moves)).uci()])
+
+
+class TestTimeManagement(unittest.TestCase):
+
+    def test_time_budget(self):
+        # no clock information, no time limit
+        self.assertIsNone(time_budget(WHITE))
+        # movetime is used as is (minus overhead)
+        self.assertAlmostEqual(time_budget(WHITE, movetime=1000), 0.95)
+        # uses the side to move clock
+        self.assertLess(
+            time_budget(WHITE, wtime=1000, btime=60000),
+            time_budget(BLACK, wtime=1000, btime=60000),
+        )
+        # increment gives us more time
+        self.assertGreater(
+            time_budget(WHITE, wtime=60000, winc=2000),
+            time_budget(WHITE, wtime=60000),
+        )
+
+    def test_search_respects_time_limit(self):
+        config = Config(
+            mode="uci",
+            algorithm="alpha_beta",
+            negamax_depth=3,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+        )
+        engine = get_engine(config)
+        board = Board("r1bqkb1r/4npp1/p1p4p/1p1pP1B1/8/1B6/PPPN1PPP/R2Q1RK1 w kq - 0 1")
+
+        start = time.monotonic()
+        infos = list(engine.iterative_deepening(board, time_limit=1))
+        elapsed = time.monotonic() - start
+
+        self.assertLess(elapsed, 2)
+        self.assertEqual([info.depth for info in infos], list(range(1, len(infos) + 1)))
+        self.assertIn(infos[-1].move, board.legal_moves)
+
+    def test_search_aborted_in_first_iteration(self):
+        config = Config(
+            mode="uci",
+            algorithm="alpha_beta",
+            negamax_depth=3,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+        )
+        engine = get_engine(config)
+        board = Board("r1bqkb1r/4npp1/p1p4p/1p1pP1B1/8/1B6/PPPN1PPP/R2Q1RK1 w kq - 0 1")
+
+        # the deadline is reached before the first iteration completes
+        move = engine.search_move(board, time_limit=0)
+
+        self.assertIsNone(engine.last_search)
+        self.assertIn(move, board.legal_moves)
+
+
+class TestMoveOrdering(unittest.TestCase):
+
+    def test_organize_moves(self):
+        # white can capture the queen with the pawn or the rook
+        board = Board("k7/8/8/3q4/4P3/8/8/K2R4 w - - 0 1")
+        move_ordering = MoveOrdering()
+        hash_move = Move.from_uci("a1b1")
+        killer = Move.from_uci("d1c1")
+        move_ordering.update(board, killer, depth=3, ply=2)
+
+        moves = move_ordering.organize_moves(board, ply=2, hash_move=hash_move)
+
+        self.assertEqual(len(moves), board.legal_moves.count())
+        self.assertEqual(moves[0], hash_move)
+        # least valuable attacker first
+        self.assertEqual(moves[1:3], [Move.from_uci("e4d5"), Move.from_uci("d1d5")])
+        self.assertEqual(moves[3], killer)
+
+    def test_history(self):
+        board = Board()
+        move_ordering = MoveOrdering()
+        move = Move.from_uci("g2g3")
+        move_ordering.update(board, move, depth=4, ply=10)
+
+        moves = move_ordering.organize_moves(board, ply=0)
+        self.assertEqual(moves[0], move)
+
+        move_ordering.clear()
+        self.assertEqual(sum(move_ordering.history), 0)
+
+
+class TestStaticExchangeEvaluation(unittest.TestCase):
+
+    @parameterized.expand([
+        # pawn takes undefended pawn
+        ("k7/8/8/3p4/4P3/8/8/K7 w - - 0 1", "e4d5", 82),
+        # pawn takes defended pawn
+        ("k7/8/4p3/3p4/4P3/8/8/K7 w - - 0 1", "e4d5", 0),
+        # queen takes defended pawn
+        ("k7/8/4p3/3p4/8/8/8/K2Q4 w - - 0 1", "d1d5", 82 - 1025),
+        # doubled rooks win the pawn against a single rook
+        ("k2r4/8/8/3p4/8/8/3R4/K2R4 w - - 0 1", "d2d5", 82),
+        # but not against doubled rooks
+        ("k2r4/3r4/8/3p4/8/8/3R4/K2R4 w - - 0 1", "d2d5", 82 - 477),
+        # en passant
+        ("k7/8/8/3pP3/8/8/8/K7 w - d6 0 1", "e5d6", 82),
+    ])
+    def test_static_exchange_evaluation(self, fen, move, expected_score):
+        score = static_exchange_evaluation(Board(fen), Move.from_uci(move))
+        self.assertEqual(score, expected_score)
+
+
+class TestIncrementalEvaluation(unittest.TestCase):
+
+    def test_matches_board_evaluation(self):
+        rng = random.Random(0)
+        for _ in range(20):
+            board = Board()
+            evaluation = IncrementalEvaluation(board)
+
+            # random games go through captures, castling, en passant and promotions
+            while not board.is_game_over() and len(board.move_stack) < 200:
+                move = rng.choice(list(board.legal_moves))
+                evaluation.push(board, move)
+                board.push(move)
+                self.assertAlmostEqual(evaluation.evaluate(board.turn), board_evaluation(board))
+
+            while board.move_stack:
+                board.pop()
+                evaluation.pop()
+                self.assertAlmostEqual(evaluation.evaluate(board.turn), board_evaluation(board))
+
+    def test_batch_evaluation(self):
+        boards = [board for board, _, _ in test_boards]
+        scores = evaluate_boards(boards)
+        for board, score in zip(boards, scores):
+            self.assertAlmostEqual(score, board_evaluation(board))
+
+
+class TestCaches(unittest.TestCase):
+
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        # "a" becomes the most recently used entry
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["evictions"]), (3, 1, 1))
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()["hits"], 0)
+
+    def test_lru_cache_ttl(self):
+        cache = LRUCache(2, ttl=0.05)
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        time.sleep(0.1)
+        # expired entries are misses
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_tablebase_missing_tables(self):
+        with tempfile.TemporaryDirectory() as path:
+            prober = TablebaseProber(path, max_pieces=5, cache_size=16)
+            board = Board("7K/8/8/8/6Q1/8/8/7k w - - 0 1")
+
+            self.assertIsNone(prober.score(board))
+            # misses are cached too
+            self.assertEqual(len(prober.cache), 1)
+            # too many pieces, tablebases aren't probed
+            self.assertIsNone(prober.score(Board()))
+            self.assertEqual(len(prober.cache), 1)
+
+    def test_tablebase_missing_directory(self):
+        prober = TablebaseProber("/nonexistent/syzygy", max_pieces=5, cache_size=16)
+        board = Board("7K/8/8/8/6Q1/8/8/7k w - - 0 1")
+        with self.assertLogs("tablebase", "WARNING"):
+            self.assertIsNone(prober.score(board))
+        # the prober is disabled, the search goes on without it
+        self.assertTrue(prober.disabled)
+        self.assertIsNone(prober.score(board))
+
+        config = Config(
+            mode="uci",
+            algorithm="alpha_beta",
+            negamax_depth=2,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path="/nonexistent/syzygy",
+            syzygy_pieces=5,
+        )
+        with self.assertLogs("tablebase", "WARNING"):
+            self.assertIn(get_engine(config).search_move(board), board.legal_moves)
+
+
+class TestAPI(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        config = Config(
+            mode="api",
+            algorithm="alpha_beta",
+            negamax_depth=3,
+            null_move=False,
+            null_move_r=2,
+            quiescence_search_depth=3,
+            syzygy_path=None,
+            syzygy_pieces=5,
+            book_path=None,
+            api_workers=1,
+            api_queue_size=0,
+        )
+        cls.app = setup(config)
+        cls.client = cls.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.app.config["SEARCH_SERVICE"].close()
+
+    def setUp(self):
+        self.wait_idle()
+
+    def wait_idle(self):
+        """
+        Waits until the searches sent to the service are released: they free
+        the worker (and update the cache) in a callback, right after their
+        result is available.
+        """
+        service = self.app.config["SEARCH_SERVICE"]
+        while service.stats()["pending"] or service.stats()["in_flight"]:
+            time.sleep(0.01)
+
+    def test_worker_engine(self):
+        config = replace(self.app.config["ENGINE_CONFIG"], threads=None)
+        engine = worker_engine(config)
+        # search options are applied to the same engine
+        self.assertIs(worker_engine(replace(config, negamax_depth=5, null_move=True)), engine)
+        self.assertTrue(engine.config.null_move)
+        self.assertIsNot(worker_engine(replace(config, hash_size=1)), engine)
+
+        # the CPUs are divided between the workers
+        cpus = os.cpu_count()
+        self.assertEqual(engine_threads(replace(config, api_workers=cpus)), 1)
+        self.assertEqual(engine_threads(replace(config, api_workers=1)), cpus)
+        self.assertEqual(engine_threads(replace(config, threads=3)), 3)
+
+    def test_worker_cpus(self):
+        config = replace(self.app.config["ENGINE_CONFIG"], cpu_affinity=list(range(8)), api_workers=3)
+        self.assertIsNone(worker_cpus(replace(config, cpu_affinity=None), 0))
+        # each worker pins its engine to its own CPUs
+        slices = [worker_cpus(config, index) for index in range(3)]
+        self.assertEqual(sorted(cpu for cpus in slices for cpu in cpus), list(range(8)))
+        self.assertEqual(engine_threads(config), 2)
+        # unless there are more workers than CPUs
+        config = replace(config, cpu_affinity=[0, 1], api_workers=4)
+        self.assertEqual([worker_cpus(config, index) for index in range(4)], [[0], [0], [1], [1]])
+        self.assertEqual(engine_threads(config), 1)
+
+    def test_search_complete_at_depth(self):
+        config = self.app.config["ENGINE_CONFIG"]
+        fen = test_boards[0][0].fen()
+
+        result = search_position(config, fen, 2, time.time() + 10)
+        self.assertTrue(result.complete)
+        self.assertEqual(result.depth, 2)
+
+        # the search stops before its depth, even if it ends before the deadline
+        result = search_position(config, fen, MAX_DEPTH, time.time() + 0.2)
+        self.assertFalse(result.complete)
+        self.assertLess(result.depth or 0, MAX_DEPTH)
+
+    @parameterized.expand([("lazy_smp", [1, 2]), ("parallel_alpha_beta_layer_1", [2])])
+    def test_stream_parallel_engines(self, algorithm, depths):
+        config = replace(self.app.config["ENGINE_CONFIG"], algorithm=algorithm, threads=2)
+        updates = queue.Queue()
+        # the engine's own search is streamed, not a serial one
+        stream_position(config, test_boards[0][0].fen(), 2, None, updates, threading.Event())
+        # closes the workers of the parallel engine
+        worker_engine(self.app.config["ENGINE_CONFIG"])
+
+        infos = list(iter(updates.get_nowait, None))
+        self.assertEqual([info.depth for info in infos[:-1]], depths)
+        self.assertEqual(infos[-1], infos[-2].move.uci())
+
+    def test_search(self):
+        fen = "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3"
+        response = self.client.get("/", query_string={"fen": fen, "depth": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(Move.from_uci(response.json["body"]["move"]), Board(fen).legal_moves)
+
+    def test_movetime_deadline(self):
+        start = time.monotonic()
+        response = self.client.get("/", query_string={"fen": test_boards[0][0].fen(), "movetime": 300})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.json["body"]["move"])
+        self.assertLess(time.monotonic() - start, 3)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get("/").status_code, 400)
+        self.assertEqual(self.client.get("/", query_string={"fen": "not a fen"}).status_code, 400)
+        response = self.client.get("/", query_string={"fen": Board().fen(), "algorithm": "unknown"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_queue_full(self):
+        service = self.app.config["SEARCH_SERVICE"]
+        config = self.app.config["ENGINE_CONFIG"]
+        # the only worker is busy and there's no room in the queue
+        search = service.search(config, test_boards[0][0].fen(), None, time.time() + 0.5)
+        response = self.client.get("/", query_string={"fen": test_boards[0][0].fen(), "depth": 3})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response.headers)
+        search.result()
+
+    def test_result_cache_and_coalescing(self):
+        service = self.app.config["SEARCH_SERVICE"]
+        config = self.app.config["ENGINE_CONFIG"]
+        fen = "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4"
+        hits = service.stats()["hits"]
+
+        # identical searches share the running one, even with the queue full
+        deadline = time.time() + 5
+        search = service.search(config, fen, 2, deadline)
+        self.assertIs(service.search(config, fen, 2, deadline), search)
+        move = search.result().move
+        self.wait_idle()
+
+        # the move number doesn't change the search
+        response = self.client.get("/", query_string={"fen": fen.replace(" 4 4", " 4 9"), "depth": 2})
+        self.assertEqual(response.json["body"]["move"], move)
+
+        stats = self.client.get("/stats").json
+        self.assertEqual(stats["hits"], hits + 1)
+        self.assertGreaterEqual(stats["coalesced"], 1)
+        self.assertEqual(stats["pending"], 0)
+
+    def test_batch(self):
+        fens = [board.fen() for board, _, _ in test_boards[:3]]
+        fens.append(fens[0])
+        response = self.client.post("/batch", json={"fens": fens, "depth": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(sorted(line["index"] for line in lines), [0, 1, 2, 3])
+        for line in lines:
+            self.assertIn(Move.from_uci(line["move"]), Board(fens[line["index"]]).legal_moves)
+            self.assertEqual(line["depth"], 1)
+        # the third position is a mate in one
+        self.assertEqual([line["mate"] for line in lines if line["index"] == 2], [1])
+
+        # EPD body, options in the query string
+        epd = '1k1r4/pp1b1R2/3q2pp/4p3/2B5/4Q3/PPP2B2/2K5 b - - bm Qd1+; id "BK.01";\n'
+        response = self.client.post("/batch?depth=1", data=epd, content_type="text/plain")
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()), 1)
+        self.assertEqual(self.client.post("/batch", json={"fens": ["not a fen"]}).status_code, 400)
+
+    def test_coalescing_with_other_deadlines(self):
+        service = self.app.config["SEARCH_SERVICE"]
+        config = self.app.config["ENGINE_CONFIG"]
+        fen = test_boards[0][0].fen()
+
+        # searches stop at their deadline, before reaching MAX_DEPTH:
+        # a search stopping before the deadline isn't shared, and the only worker is busy
+        search = service.search(config, fen, MAX_DEPTH, time.time() + 0.2)
+        with self.assertRaises(QueueFull):
+            service.search(config, fen, MAX_DEPTH, time.time() + 30)
+        self.assertFalse(search.result().complete)
+        self.wait_idle()
+
+        # nor is one that would keep the request waiting past its deadline
+        search = service.search(config, fen, MAX_DEPTH, time.time() + 1)
+        with self.assertRaises(QueueFull):
+            service.search(config, fen, MAX_DEPTH, time.time() + 0.2)
+        search.result()
+        self.wait_idle()
+
+        deadline = time.time() + 1
+        search = service.search(config, fen, MAX_DEPTH, deadline)
+        self.assertIs(service.search(config, fen, MAX_DEPTH, deadline - COALESCE_WINDOW / 2), search)
+        search.result()
+
+    def test_stream(self):
+        fen = "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3"
+        response = self.client.get("/stream", query_string={"fen": fen, "depth": 3})
+        self.assertEqual(response.mimetype, "text/event-stream")
+
+        events = [
+            (event.split("\n")[0], json.loads(event.split("data: ")[1]))
+            for event in response.get_data(as_text=True).split("\n\n")
+            if event.startswith("event:")
+        ]
+        self.assertEqual([data["depth"] for name, data in events[:-1]], [1, 2, 3])
+        self.assertEqual(events[-1][0], "event: bestmove")
+        self.assertEqual(events[-1][1]["move"], events[-2][1]["pv"][0])
+
+    def test_stream_error(self):
+        updates = queue.Queue()
+        for update in [SearchFailed("RuntimeError()"), None]:
+            updates.put(update)
+        cancel = threading.Event()
+        events = list(search_events(Future(), updates, cancel, self.app.config["ENGINE_CONFIG"]))
+        self.assertEqual(len(events), 1)
+        self.assertTrue(events[0].startswith("event: error"))
+        self.assertTrue(cancel.is_set())
+
+    def test_stream_cancelled_on_disconnect(self):
+        response = self.client.get(
+            "/stream", query_string={"fen": Board().fen(), "movetime": 10000}, buffered=False,
+        )
+        start = time.monotonic()
+        self.assertTrue(next(response.response).startswith(b"event: info"))
+        # the client goes away, the worker stops searching
+        response.close()
+        self.wait_idle()
+        self.assertLess(time.monotonic() - start, 5)
+
+
+def write_book(path: str, entries):
+    """
+    Writes a polyglot book with the given (board, move, weight) entries.
+    """
+    packed = []
+    for board, move, weight in entries:
+        raw_move = move.to_square | move.from_square << 6 | ((move.promotion or 1) - 1) << 12
+        packed.append(struct.pack(">QHHI", zobrist_hash(board), raw_move, weight, 0))
+    with open(path, "wb") as book_file:
+        book_file.write(b"".join(sorted(packed)))
+
+
+class TestOpeningBook(unittest.TestCase):
+
+    @parameterized.expand([(False,), (True,)])
+    def test_lookups(self, in_memory):
+        castling = Board("r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1")
+        with tempfile.TemporaryDirectory() as path:
+            book_path = os.path.join(path, "book.bin")
+            write_book(book_path, [
+                (Board(), Move.from_uci("e2e4"), 10),
+                (Board(), Move.from_uci("d2d4"), 30),
+                (Board(), Move.from_uci("g1f3"), 0),
+                # polyglot castling is the king taking its rook
+                (castling, Move.from_uci("e1h1"), 1),
+            ])
+            book = OpeningBook(book_path, in_memory)
+            self.assertEqual(len(book), 4)
+            self.assertEqual(book.choose(Board()), Move.from_uci("d2d4"))
+            self.assertIn(book.choose(Board(), "weighted"), [Move.from_uci("e2e4"), Move.from_uci("d2d4")])
+            self.assertEqual(book.choose(castling), Move.from_uci("e1g1"))
+
+            board = Board()
+            board.push_uci("e2e4")
+            self.assertIsNone(book.choose(board))
+            # the book is only used for the first plies
+            self.assertIsNone(book.choose(castling, max_ply=0))
+
+    def test_missing_or_invalid_book(self):
+        self.assertIsNone(OpeningBook(None).choose(Board()))
+        with tempfile.TemporaryDirectory() as path:
+            self.assertIsNone(OpeningBook(os.path.join(path, "missing.bin")).choose(Board()))
+            book_path = os.path.join(path, "pointer.bin")
+            with open(book_path, "w") as book_file:
+                book_file.write("version https://git-lfs.github.com/spec/v1\n")
+            self.assertEqual(len(OpeningBook(book_path, in_memory=True)), 0)
+
 
 if __name__ == "__main__":
     unittest.main()
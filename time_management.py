@@ -0,0 +1,53 @@
+from typing import Optional
+
+from chess import WHITE, Color
+
+# Time (in seconds) kept aside for communication with the GUI.
+MOVE_OVERHEAD = 0.05
+# Number of moves we assume are left in the game when
+# the GUI doesn't tell us (movestogo).
+DEFAULT_MOVES_TO_GO = 30
+# Fraction of the increment we're willing to spend on each move.
+INCREMENT_USAGE = 0.75
+# Maximum fraction of the remaining time to spend on a single move.
+MAX_TIME_USAGE = 0.5
+
+
+def time_budget(
+    turn: Color,
+    wtime: Optional[int] = None,
+    btime: Optional[int] = None,
+    winc: Optional[int] = None,
+    binc: Optional[int] = None,
+    movestogo: Optional[int] = None,
+    movetime: Optional[int] = None,
+) -> Optional[float]:
+    """
+    Computes how long we should search for the current move,
+    based on the UCI `go` arguments. All arguments are in
+    milliseconds, as sent by the GUI.
+
+    Arguments:
+        - turn: side to move.
+        - wtime/btime: remaining time on white's and black's clock.
+        - winc/binc: white's and black's increment per move.
+        - movestogo: moves left until the next time control.
+        - movetime: exact time to search for.
+
+    Returns:
+        - budget: time to search in seconds, or None if there's no time limit.
+    """
+    if movetime is not None:
+        return max(movetime / 1000 - MOVE_OVERHEAD, 0.01)
+
+    remaining = wtime if turn == WHITE else btime
+    if remaining is None:
+        return None
+    increment = (winc if turn == WHITE else binc) or 0
+
+    remaining_s = remaining / 1000
+    budget = remaining_s / (movestogo or DEFAULT_MOVES_TO_GO) + INCREMENT_USAGE * increment / 1000
+
+    # never spend more than a fraction of what's left on the clock
+    budget = min(budget, remaining_s * MAX_TIME_USAGE)
+    return max(budget - MOVE_OVERHEAD, 0.01)
@@ -0,0 +1,236 @@
+import struct
+from typing import Dict, NamedTuple, Optional
+
+from chess import Board, Move
+from chess.polyglot import zobrist_hash
+
+from shared_buffer import SharedBuffer
+
+# Bound types stored alongside a score.
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# Approximate memory (in bytes) taken by one stored entry,
+# used to turn the hash size in MB into a number of slots.
+ENTRY_SIZE = 320
+
+# Shared table entries are packed in three 64 bit words:
+# check (key ^ score ^ data), score (float64 bits) and data.
+SHARED_ENTRY_WORDS = 3
+SHARED_ENTRY_SIZE = SHARED_ENTRY_WORDS * 8
+# Bit layout of the data word.
+MOVE_BITS = 16
+DEPTH_SHIFT = 16
+BOUND_SHIFT = 24
+AGE_SHIFT = 26
+OCCUPIED = 1 << 32
+
+DOUBLE = struct.Struct("<d")
+UINT64 = struct.Struct("<Q")
+
+
+def pack_move(move: Optional[Move]) -> int:
+    """
+    Packs a move in 16 bits, 0 means no move.
+    """
+    if move is None:
+        return 0
+    return (move.from_square | move.to_square << 6 | (move.promotion or 0) << 12) + 1
+
+
+def unpack_move(code: int) -> Optional[Move]:
+    """
+    Unpacks a move packed with `pack_move`.
+    """
+    if code == 0:
+        return None
+    code -= 1
+    return Move(code & 63, (code >> 6) & 63, (code >> 12) or None)
+
+
+class TTEntry(NamedTuple):
+    """
+    A single transposition table entry.
+    """
+    key: int
+    depth: int
+    score: float
+    bound: int
+    move: Optional[Move]
+    age: int
+
+
+class TranspositionTable:
+    """
+    Fixed-size hash table indexed by the 64-bit Zobrist key of a position.
+
+    Each slot keeps a single entry. When two positions map to the same slot,
+    the deeper search is preferred, unless the stored entry belongs to an
+    older search (age), in which case it is always replaced.
+    """
+
+    def __init__(self, size_mb: int):
+        """
+        Arguments:
+            - size_mb: size of the table in megabytes.
+        """
+        self.size = max(1, (size_mb * 2**20) // ENTRY_SIZE)
+        # entries by slot
+        self.table: Dict[int, TTEntry] = {}
+        self.age = 0
+
+    @staticmethod
+    def key(board: Board) -> int:
+        """
+        Returns the Zobrist hash of the board.
+        """
+        return zobrist_hash(board)
+
+    def probe(self, key: int) -> Optional[TTEntry]:
+        """
+        Returns the entry stored for the key, if any.
+
+        Arguments:
+            - key: Zobrist hash of the position.
+
+        Returns:
+            - entry: stored entry or None if the position is not in the table.
+        """
+        entry = self.table.get(key % self.size)
+        if entry is None or entry.key != key:
+            return None
+        return entry
+
+    def store(self, key: int, depth: int, score: float, bound: int, move: Optional[Move]):
+        """
+        Stores a search result, following a depth-preferred replacement
+        scheme that always replaces entries from older searches.
+
+        Arguments:
+            - key: Zobrist hash of the position.
+            - depth: depth of the search that produced the result.
+            - score: score of the position.
+            - bound: one of EXACT, LOWER or UPPER.
+            - move: best move found, if any.
+        """
+        index = key % self.size
+        entry = self.table.get(index)
+
+        replace = entry is None or entry.key == key or entry.age != self.age or depth >= entry.depth
+        if replace:
+            # keep the previous best move if we don't have a new one
+            if move is None and entry is not None and entry.key == key:
+                move = entry.move
+            self.table[index] = TTEntry(key, depth, score, bound, move, self.age)
+
+    def new_search(self):
+        """
+        Marks the start of a new search, entries from
+        previous searches become replaceable.
+        """
+        self.age = (self.age + 1) % 64
+
+    def clear(self):
+        """
+        Removes all entries from the table.
+        """
+        self.table.clear()
+        self.age = 0
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+
+class SharedTranspositionTable(TranspositionTable):
+    """
+    Transposition table stored in shared memory, so every process
+    of a parallel search reads and writes the same entries directly,
+    without going through a manager process.
+
+    Entries are packed in a fixed-size array and written without locks.
+    Each entry stores key ^ score ^ data instead of the key, so an entry
+    that was partially overwritten by another process (torn write) doesn't
+    verify against the key being probed and is treated as a miss.
+    """
+
+    def __init__(self, size_mb: int):
+        """
+        Arguments:
+            - size_mb: size of the table in megabytes.
+        """
+        self.size = max(1, (size_mb * 2**20) // SHARED_ENTRY_SIZE)
+        # one extra word to store the age, shared by all processes
+        self.buffer = SharedBuffer((self.size * SHARED_ENTRY_WORDS + 1) * 8)
+        self._map_buffer()
+
+    def _map_buffer(self):
+        self.words = self.buffer.cast("Q")
+
+    def __getstate__(self):
+        # only the shared buffer is sent, views are mapped again
+        return {"size": self.size, "buffer": self.buffer}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._map_buffer()
+
+    @property
+    def age(self) -> int:  # type: ignore[override]
+        return self.words[self.size * SHARED_ENTRY_WORDS]
+
+    @age.setter
+    def age(self, age: int):
+        self.words[self.size * SHARED_ENTRY_WORDS] = age
+
+    def _read(self, index: int) -> Optional[TTEntry]:
+        base = index * SHARED_ENTRY_WORDS
+        words = self.words
+        check, score_bits, data = words[base], words[base + 1], words[base + 2]
+        if not data & OCCUPIED:
+            return None
+        return TTEntry(
+            key=check ^ score_bits ^ data,
+            depth=(data >> DEPTH_SHIFT) & 0xFF,
+            score=DOUBLE.unpack(UINT64.pack(score_bits))[0],
+            bound=(data >> BOUND_SHIFT) & 0b11,
+            move=unpack_move(data & ((1 << MOVE_BITS) - 1)),
+            age=(data >> AGE_SHIFT) & 0b111111,
+        )
+
+    def probe(self, key: int) -> Optional[TTEntry]:
+        entry = self._read(key % self.size)
+        if entry is None or entry.key != key:
+            return None
+        return entry
+
+    def store(self, key: int, depth: int, score: float, bound: int, move: Optional[Move]):
+        index = key % self.size
+        entry = self._read(index)
+        age = self.age
+
+        replace = entry is None or entry.key == key or entry.age != age or depth >= entry.depth
+        if replace:
+            # keep the previous best move if we don't have a new one
+            if move is None and entry is not None and entry.key == key:
+                move = entry.move
+
+            depth = min(max(depth, 0), 0xFF)
+            data = OCCUPIED | age << AGE_SHIFT | bound << BOUND_SHIFT | depth << DEPTH_SHIFT | pack_move(move)
+            score_bits = UINT64.unpack(DOUBLE.pack(score))[0]
+
+            base = index * SHARED_ENTRY_WORDS
+            words = self.words
+            words[base + 1] = score_bits
+            words[base + 2] = data
+            words[base] = key ^ score_bits ^ data
+
+    def clear(self):
+        self.buffer.shared_memory.buf[:] = bytes(len(self.buffer.shared_memory.buf))
+
+    def __len__(self) -> int:
+        words = self.words
+        return sum(
+            1 for index in range(self.size)
+            if words[index * SHARED_ENTRY_WORDS + 2] & OCCUPIED
+        )